@@ -0,0 +1,218 @@
+from random import Random
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numba
+import numpy as np
+import pandas as pd
+from poker_eval import Evaluator, Card, cards_to_str, get_generic_id, get_generic_ids_batch, precomputed_tables_exist
+from hand_index import NO_CARD
+import process_csv
+
+
+# Benchmarks of the evaluator primitives and of process_csv. Each case is timed over n_repeats calls
+# after one warm-up call (JIT compilation), the peak of the memory allocated during one call is measured
+# separately with tracemalloc because tracing slows the calls down.
+# Hands are drawn with a fixed seed, so two runs measure the same work.
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STREETS = (('preflop', 0), ('flop', 3), ('turn', 4), ('river', 5))
+
+# Run in a new interpreter by the startup cases, prints the duration of each step in seconds and the peak memory
+STARTUP_SCRIPT = '''
+import json, resource, time
+times = {}
+start = time.perf_counter()
+import poker_cards
+times['import_poker_cards'] = time.perf_counter() - start
+start = time.perf_counter()
+import poker_eval
+times['import_poker_eval'] = time.perf_counter() - start
+start = time.perf_counter()
+evaluator = poker_eval.Evaluator()
+evaluator.eval(poker_cards.str_to_cards('asadkh2c3d7s9h'))
+times['first_eval'] = time.perf_counter() - start
+start = time.perf_counter()
+evaluator.full_evaluation('asad', 'kh2c3d')
+times['first_full_evaluation'] = time.perf_counter() - start
+print(json.dumps({'times': times, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10}))
+'''
+
+
+def random_hands(rng: Random, n_hands: int, n_cards: int):
+    return [[Card(card) for card in rng.sample(range(52), n_cards)] for _ in range(n_hands)]
+
+
+def hands_to_array(hands):
+    cards = np.full((len(hands), 7), NO_CARD, dtype=np.int64)
+    for i, hand in enumerate(hands):
+        cards[i, :len(hand)] = [card.idx for card in hand]
+    return cards
+
+
+def cases(evaluator: Evaluator, seed: int, csv_path: str):
+    # (name, function of the iteration number, items processed per call, number of calls)
+    rng = Random(seed)
+    hands = random_hands(rng, 1000, 7)
+    batch = hands_to_array(random_hands(rng, 100_000, 7))
+    yield 'eval', lambda i: evaluator.eval(hands[i % len(hands)]), 1, 10_000
+    yield 'eval_batch', lambda i: evaluator.eval_batch(batch), len(batch), 10
+    yield 'get_checker', lambda i: evaluator.get_checker(hands[i % len(hands)][:2], hands[i % len(hands)][2:]), 1, 10_000
+    yield 'get_checker_batch', lambda i: evaluator.get_checker_batch(batch), len(batch), 10
+    yield 'check_odds_exact_turn', lambda i: evaluator.check_odds_exact(hands[i][:2], hands[i][2:6]), 1, 200
+    yield 'check_odds_exact_river', lambda i: evaluator.check_odds_exact(hands[i][:2], hands[i][2:]), 1, 1000
+    yield 'check_odds_monte_carlo_flop', lambda i: evaluator.check_odds_monte_carlo(
+        hands[i][:2], hands[i][2:5], target_std_error=0.002, seed=seed + i), 1, 20
+    for street, board_size in STREETS:
+        strs = [(cards_to_str(hand[:2]), cards_to_str(hand[2:2 + board_size])) for hand in hands]
+        n_repeats = 50 if street == 'flop' else 1000
+        yield f'full_evaluation_{street}', lambda i, strs=strs: evaluator.full_evaluation(*strs[i % len(strs)]), 1, n_repeats
+    yield 'get_generic_id', lambda i: get_generic_id(hands[i % len(hands)]), 1, 10_000
+    yield 'get_generic_ids_batch', lambda i: get_generic_ids_batch(batch), len(batch), 10
+
+    df = pd.read_csv(csv_path, sep=';')
+    precomputed = precomputed_tables_exist()
+    with tempfile.TemporaryDirectory() as directory:
+        sample_path = os.path.join(directory, 'sample.csv')
+        df.head(100).to_csv(sample_path, sep=';', index=False)
+        output_path = os.path.join(directory, 'output.csv')
+
+        def run_process_csv(i):
+            # the first call (warm-up) compiles the kernels on a small sample
+            process_csv.process_csv(sample_path if i < 0 else csv_path, output_path, precomputed=precomputed)
+        yield 'process_csv', run_process_csv, len(df), 1
+
+
+def measure(function, n_items: int, n_repeats: int):
+    function(-1)
+    times = []
+    for i in range(n_repeats):
+        start = time.perf_counter()
+        function(i)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = np.array(times)
+    return {
+        'n_repeats': n_repeats,
+        'mean': float(times.mean()),
+        'min': float(times.min()),
+        'p50': float(np.percentile(times, 50)),
+        'p90': float(np.percentile(times, 90)),
+        'p99': float(np.percentile(times, 99)),
+        'items_per_s': float(n_items / times.mean()),
+        'peak_memory_mb': peak / 2**20,
+    }
+
+
+def run_startup_script(env=None):
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=DIRECTORY, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def startup_cases(n_repeats: int=5):
+    # Time of each startup step in a new process. The warm cases load the kernels from the numba cache
+    # (filled by a first run), the cold ones compile them with an empty cache directory.
+    run_startup_script()
+    with tempfile.TemporaryDirectory() as cache_directory:
+        cold_env = dict(os.environ, NUMBA_CACHE_DIR=cache_directory)
+        all_runs = {'': [run_startup_script() for _ in range(n_repeats)], '_cold': [run_startup_script(cold_env)]}
+    for suffix, runs in all_runs.items():
+        for step in runs[0]['times']:
+            times = np.array([run['times'][step] for run in runs])
+            yield f'startup_{step}{suffix}', {
+                'n_repeats': len(runs),
+                'mean': float(times.mean()),
+                'min': float(times.min()),
+                'p50': float(np.percentile(times, 50)),
+                'p90': float(np.percentile(times, 90)),
+                'p99': float(np.percentile(times, 99)),
+                'items_per_s': float(1 / times.mean()),
+                'peak_memory_mb': max(run['max_rss_mb'] for run in runs),
+            }
+
+
+def print_result(name, result):
+    print(f"{name:<36} p50 {result['p50'] * 1e3:10.3f} ms  p90 {result['p90'] * 1e3:10.3f} ms  "
+          f"p99 {result['p99'] * 1e3:10.3f} ms  {result['items_per_s']:14,.0f} items/s  "
+          f"peak {result['peak_memory_mb']:8.1f} MB")
+
+
+def run(output='benchmark.json', seed=0, csv_path=os.path.join(DIRECTORY, 'input.csv'), only=None):
+    evaluator = Evaluator()
+    results = {}
+    stdout = sys.stdout
+    for name, function, n_items, n_repeats in cases(evaluator, seed, csv_path):
+        if only is not None and name not in only:
+            continue
+        with open(os.devnull, 'w') as devnull:
+            # process_csv prints its progress
+            sys.stdout = devnull
+            try:
+                results[name] = measure(function, n_items, n_repeats)
+            finally:
+                sys.stdout = stdout
+        print_result(name, results[name])
+    if only is None or any(name.startswith('startup') for name in only):
+        for name, result in startup_cases():
+            if only is not None and name not in only and 'startup' not in only:
+                continue
+            results[name] = result
+            print_result(name, result)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seed': seed,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+            'cpu_count': os.cpu_count(),
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        },
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(report, baseline_path, threshold=0.1):
+    # Cases whose median time grew by more than threshold (relative) since the baseline
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline:
+            continue
+        ratio = result['p50'] / baseline[name]['p50']
+        status = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f"{name:<36} {baseline[name]['p50'] * 1e3:10.3f} ms -> {result['p50'] * 1e3:10.3f} ms  ({ratio:6.2f}x) {status}")
+        if status:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="results of a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="tolerated relative slowdown of the median")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', help="names of the cases to run")
+    parser.add_argument('--csv', default=os.path.join(DIRECTORY, 'input.csv'), help="input of the process_csv case")
+    args = parser.parse_args()
+    report = run(args.output, args.seed, args.csv, args.only)
+    if args.baseline is not None:
+        if compare(report, args.baseline, args.threshold):
+            sys.exit(1)
@@ -1,157 +1,217 @@
 
 import numpy as np
 import pandas as pd
-from poker_eval import get_generic_hand, get_hand_id, str_to_cards_bis, cards_to_str_bis, Evaluator
+from poker_eval import get_generic_hands_batch, get_hand_ids_batch, strs_to_hands, array_to_strs, Evaluator, Card, POCKET_IDS
+from poker_eval import histograms_to_strs, POTENTIAL_METRICS
+from hand_index import NO_CARD
+from lookup_store import export_columnar
+from collections import deque
+from functools import partial
+from numba import njit
 import multiprocessing
+import numba
 import os
 
 
-def process_row_generic(row):
-    hand = []
-    for group in ['Pocket', 'Table', 'Turn', 'River']:
-        if row[group] != "-":
-            hand += str_to_cards_bis(row[group])
-    generic_hand = get_generic_hand(hand, group_sizes=[2, 3, 1, 1])
-    generic_id = get_hand_id(generic_hand)
-    row['generic_id'] = generic_id
-    generic_pocket = generic_hand[:2]
-    row['generic_pocket'] = cards_to_str_bis(generic_pocket)
-    if len(generic_hand) > 2:
-        generic_table = generic_hand[2:5]
-        row['generic_table'] = cards_to_str_bis(generic_table)
-    if len(generic_hand) > 5:
-        generic_turn = generic_hand[5:6]
-        row['generic_turn'] = cards_to_str_bis(generic_turn)
-    if len(generic_hand) > 6:
-        generic_river = generic_hand[6:7]
-        row['generic_river'] = cards_to_str_bis(generic_river)
-    return row
-
-
-def process_chunk_generic(df, idx, queue):
-    df['generic_id'] = -1
-    df['generic_table'] = "-"
-    df['generic_turn'] = "-"
-    df['generic_river'] = "-"
-    df['generic_pocket'] = "-"
-    df = df.apply(process_row_generic, axis=1)
-    queue.put((idx, df))
-
-
-def process_row_proba_stage(evaluator: Evaluator, pocket_str: str, board_str: str, row, stage):
-    rank, checker, prob_win, prob_draw = evaluator.full_evaluation(pocket_str, board_str, bis_formatting=True)
-    row['proba_win_' + stage] = prob_win
-    row['proba_draw_' + stage] = prob_draw
-    if stage != 'preflop':
-        try:
-            rank_str = evaluator.rank_to_str(rank)
-        except TypeError:
-            print(pocket_str, board_str, row, stage)
-            return
-        row['best_hand_' + stage] = rank_str
-        row['checker_' + stage] = checker
-
-
-def process_row_proba(evaluator, row):
-    process_row_proba_stage(evaluator, row['Pocket'], "", row, 'preflop')
-    if row['Table'] == "-":
-        return row
-    process_row_proba_stage(evaluator, row['Pocket'], row['Table'], row, 'flop')
-    if row['Turn'] == "-":
-        return row
-    process_row_proba_stage(evaluator, row['Pocket'], row['Table'] + row['Turn'], row, 'turn')
-    if row['River'] == "-":
-        return row
-    process_row_proba_stage(evaluator, row['Pocket'], row['Table'] + row['Turn'] + row['River'], row, 'river')
-    return row
-
-
-def process_chunk_proba(df, idx, queue):
-    evaluator = Evaluator(precomputed=True)
-    df['proba_win_preflop'] = np.nan
-    df['proba_draw_preflop'] = np.nan
-    for stage in ('flop', 'turn', 'river'):
-        df['best_hand_' + stage] = "-"
-        for col in ('checker', 'proba_win', 'proba_draw'):
-            df[col + '_' + stage] = np.nan
-    df = df.apply(lambda row : process_row_proba(evaluator, row), axis=1)
-    queue.put((idx, df))
-    
-
-def process_parallel_chunk(df_iterator, output, first, n_workers, process_func) -> bool:
-    queue = multiprocessing.Queue()
-    processes = []
-    for i in range(n_workers):
-        try:
-            chunk = next(df_iterator)
-            p = multiprocessing.Process(target=process_func, args=(chunk, i, queue))
-            processes.append(p)
-        except StopIteration:
-            break
-    
-    n_processes = len(processes)
-    for p in processes:
-        p.start()
-
-    results = []
-    while len(results) < n_processes:
-        results.append(queue.get())
-    results = sorted(results, key=lambda x : x[0])
-    for _, df in results:
-        if first:
-            df.to_csv(output, index=False)
-        else:
-            df.to_csv(output, index=False, mode='a', header=False)
-        first = False
-
-    return n_processes < n_workers
-    
-
-def process_csv(filename, output, process_chunk_func, n_workers, chunksize):
+# Evaluator of the worker process, created once by init_proba_worker
+_evaluator = None
+
+# Streets after the preflop and their number of cards (pocket included)
+STAGES = (('flop', 5), ('turn', 6), ('river', 7))
+
+# On the streets without precomputed table (the river, or every street when precalc_flop_turn.py was not run),
+# rows of a chunk sharing a board with at least BOARD_GROUP_MIN_ROWS rows get their odds from
+# Evaluator.board_equities, which computes all the pockets of the board at once (same values as check_odds_batch)
+BOARD_GROUP_MIN_ROWS = 32
+
+
+# Free slot of the SeenIds table, ids are >= 0
+EMPTY = -1
+
+
+@njit(cache=True)
+def _insert_ids(table: np.ndarray, ids: np.ndarray):
+    # Linear probing in a power of two sized table, returns the mask of the ids inserted (not in the table before)
+    bits = np.uint64(64 - int(np.log2(len(table))))
+    inserted = np.zeros(len(ids), dtype=np.bool_)
+    for i in range(len(ids)):
+        slot = np.int64((np.uint64(ids[i]) * np.uint64(0x9E3779B97F4A7C15)) >> bits)
+        while table[slot] != EMPTY and table[slot] != ids[i]:
+            slot = (slot + 1) & (len(table) - 1)
+        if table[slot] == EMPTY:
+            table[slot] = ids[i]
+            inserted[i] = True
+    return inserted
+
+
+class SeenIds:
+    # Set of int64 ids as an open addressing hash table kept at most half full, i.e. 16 to 32 bytes per id
+    def __init__(self, capacity: int=1 << 20):
+        self.table = np.full(capacity, EMPTY, dtype=np.int64)
+        self.size = 0
+
+    def add(self, ids: np.ndarray):
+        # Mask of the first occurrences of ids not seen before
+        ids = np.asarray(ids, dtype=np.int64)
+        if 2 * (self.size + len(ids)) > len(self.table):
+            capacity = len(self.table)
+            while 2 * (self.size + len(ids)) > capacity:
+                capacity *= 2
+            old_table = self.table
+            self.table = np.full(capacity, EMPTY, dtype=np.int64)
+            _insert_ids(self.table, old_table[old_table != EMPTY])
+        inserted = _insert_ids(self.table, ids)
+        self.size += int(inserted.sum())
+        return inserted
+
+
+def read_hands(df):
+    # (N, 7) int array of the Pocket, Table, Turn and River columns, missing cards are NO_CARD
+    df = df[['Pocket', 'Table', 'Turn', 'River']].replace("-", "")
+    return strs_to_hands(df['Pocket'], df['Table'], df['Turn'], df['River'], bis_formatting=True)
+
+
+def process_chunk_generic(df):
+    generic_hands = get_generic_hands_batch(read_hands(df))
+    df['generic_id'] = get_hand_ids_batch(generic_hands)
+    for column, start, end in (('table', 2, 5), ('turn', 5, 6), ('river', 6, 7), ('pocket', 0, 2)):
+        generic_cards = array_to_strs(generic_hands[:, start:end], bis_formatting=True)
+        df['generic_' + column] = np.where(generic_cards == "", "-", generic_cards)
+    return df
+
+
+def init_proba_worker():
+    # The workers already run in parallel, the numba kernels use a single thread each
+    global _evaluator
+    numba.set_num_threads(1)
+    _evaluator = Evaluator(precomputed=True)
+
+
+def stage_odds(evaluator: Evaluator, pockets, boards):
+    # (N, 2) odds of the pockets on their boards, rows are grouped by board (in any card order)
+    if evaluator.precomputed and boards.shape[1] < 5:
+        # table lookups
+        return evaluator.check_odds_batch(pockets, boards)
+    odds = np.empty((len(pockets), 2))
+    unique_boards, inverse, counts = np.unique(np.sort(boards, axis=1), axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    for b in np.nonzero(counts >= BOARD_GROUP_MIN_ROWS)[0]:
+        rows = np.nonzero(inverse == b)[0]
+        equities = evaluator.board_equities([Card(card) for card in unique_boards[b]])
+        odds[rows] = equities[POCKET_IDS[pockets[rows, 0], pockets[rows, 1]]]
+    rows = np.nonzero(counts[inverse] < BOARD_GROUP_MIN_ROWS)[0]
+    if len(rows) > 0:
+        odds[rows] = evaluator.check_odds_batch(pockets[rows], boards[rows])
+    return odds
+
+
+def process_chunk_proba(df, metrics=False):
+    # metrics : adds the hand strength, potential and equity histogram columns. Their enumeration of the runouts
+    # also gives the odds, except on the flop and turn where the table odds are still used (and much faster)
+    hands = read_hands(df)
+    odds = _evaluator.check_odds_batch(hands[:, :2], hands[:, 2:2])
+    df['proba_win_preflop'] = odds[:, 0]
+    df['proba_draw_preflop'] = odds[:, 1]
+    for stage, n_cards in STAGES:
+        best_hand = np.full(len(df), "-", dtype=object)
+        checker = np.full(len(df), np.nan)
+        odds = np.full((len(df), 2), np.nan)
+        stage_metrics = {metric: np.full(len(df), np.nan) for metric in POTENTIAL_METRICS}
+        stage_metrics['equity_histogram'] = np.full(len(df), np.nan, dtype=object)
+        rows = np.nonzero(hands[:, n_cards - 1] != NO_CARD)[0]
+        if len(rows) > 0:
+            cards = hands[rows, :n_cards]
+            best_hand[rows] = _evaluator.ranks_to_str(_evaluator.eval_batch(cards))
+            checker[rows] = _evaluator.get_checker_batch(cards)
+            if metrics:
+                rows_metrics = _evaluator.hand_metrics_batch(cards[:, :2], cards[:, 2:])
+                if _evaluator.precomputed and stage != 'river':
+                    odds[rows] = stage_odds(_evaluator, cards[:, :2], cards[:, 2:])
+                else:
+                    odds[rows, 0] = rows_metrics['proba_win']
+                    odds[rows, 1] = rows_metrics['proba_draw']
+                for metric in POTENTIAL_METRICS:
+                    stage_metrics[metric][rows] = rows_metrics[metric]
+                stage_metrics['equity_histogram'][rows] = histograms_to_strs(rows_metrics['equity_histogram'])
+            else:
+                odds[rows] = stage_odds(_evaluator, cards[:, :2], cards[:, 2:])
+        df['best_hand_' + stage] = best_hand
+        df['checker_' + stage] = checker
+        df['proba_win_' + stage] = odds[:, 0]
+        df['proba_draw_' + stage] = odds[:, 1]
+        if metrics:
+            for metric, values in stage_metrics.items():
+                df[metric + '_' + stage] = values
+    return df
+
+
+def process_chunk(process_chunk_func, df, header, unique=None):
+    # Runs in a worker, the chunk goes back to the writer as csv text. With unique, the writer filters the rows
+    # before writing them : the chunk goes back as a DataFrame, without the rows repeating a value of the chunk
+    df = process_chunk_func(df)
+    if unique is not None:
+        return df.drop_duplicates(subset=[unique], keep='first')
+    return df.to_csv(index=False, header=header)
+
+
+def process_csv(filename, output, process_chunk_func, n_workers=None, chunksize=100000, initializer=None, unique=None):
+    # Chunks are processed by a pool of long-lived workers. At most 2*n_workers chunks are in flight,
+    # so reading the input, processing and writing the output in order overlap with bounded memory.
+    # unique : name of a column, only the first row of each of its values is written
+    if n_workers is None:
+        n_workers = os.cpu_count()
     df_iterator = pd.read_csv(filename, keep_default_na=False, chunksize=chunksize, iterator=True)
+    pending = deque()
+    seen = SeenIds()
     n_processed = 0
-    while not process_parallel_chunk(df_iterator, output, n_processed==0, n_workers, process_chunk_func):
-        n_processed += n_workers*chunksize
-        print('\r{:,}'.format(n_processed), end='')
+    with multiprocessing.Pool(n_workers, initializer=initializer) as pool, open(output, 'w', newline='') as f:
+        def write_next():
+            nonlocal n_processed
+            result, n_rows, header = pending.popleft()
+            result = result.get()
+            if unique is not None:
+                result = result[seen.add(result[unique].to_numpy())].to_csv(index=False, header=header)
+            f.write(result)
+            n_processed += n_rows
+            print('\r{:,}'.format(n_processed), end='')
+
+        for i, chunk in enumerate(df_iterator):
+            pending.append((pool.apply_async(process_chunk, (process_chunk_func, chunk, i == 0, unique)), len(chunk), i == 0))
+            while len(pending) >= 2 * n_workers or (pending and pending[0][0].ready()):
+                write_next()
+        while pending:
+            write_next()
+    if unique is not None:
+        print(' rows, {:,} unique'.format(seen.size), end='')
     print("")
 
 
-def filter_df(df):
-    return df.drop_duplicates(subset=['generic_id'], keep='first')
-
-
 def filter_csv(filename, output, chunksize):
-    first = True
+    # Keeps the first row of each generic_id, in a single pass over the file
+    seen = SeenIds()
     n_processed = 0
-    for df in pd.read_csv(filename, keep_default_na=False, chunksize=chunksize, iterator = True):
-        result = filter_df(df)
-        if first:
-            result.to_csv(output, index=False)
-            first = False
-        else:
-            result.to_csv(output, index=False, mode='a', header=False)
-        n_processed += chunksize
-        print('\r{:,}'.format(n_processed), end='')
+    with open(output, 'w', newline='') as f:
+        for i, df in enumerate(pd.read_csv(filename, keep_default_na=False, chunksize=chunksize, iterator=True)):
+            df[seen.add(df['generic_id'].to_numpy())].to_csv(f, index=False, header=(i == 0))
+            n_processed += len(df)
+            print('\r{:,}'.format(n_processed), end='')
     print("")
-    df = pd.read_csv(output, keep_default_na=False)
-    df = filter_df(df)
-    df.to_csv(output, index=False)
-    
-
-def run(csvpath, output_generic, output_filtered, output_with_probs):
-    print("Generic hands processing")
-    process_csv(csvpath, output_generic, process_chunk_generic, n_workers=8, chunksize=100000)
-    print("Filtering duplicates")
-    filter_csv(output_generic, output_filtered, chunksize=1000000)
+
+
+def run(csvpath, output_filtered, output_with_probs, output_columnar, metrics=False):
+    print("Generic hands processing and filtering of duplicates")
+    process_csv(csvpath, output_filtered, process_chunk_generic, chunksize=100000, unique='generic_id')
     print("Odds processing")
-    process_csv(output_filtered, output_with_probs, process_chunk_proba, n_workers=2, chunksize=100000)
-    #os.remove(output_generic)
+    process_csv(output_filtered, output_with_probs, partial(process_chunk_proba, metrics=metrics), chunksize=100000,
+                initializer=init_proba_worker)
+    print("Columnar export")
+    export_columnar(output_with_probs, output_columnar)
     #os.remove(output_filtered) 
 
 if __name__ == '__main__':
     run(
         csvpath='dbg_260123.csv', 
-        output_generic='dbg_260123_generic.csv',
         output_filtered='dbg_260123_filtered.csv',
-        output_with_probs='dbg_260123_filtered_with_probs.csv'
+        output_with_probs='dbg_260123_filtered_with_probs.csv',
+        output_columnar='dbg_260123_filtered_with_probs.columnar'
         )
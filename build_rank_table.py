@@ -0,0 +1,303 @@
+from itertools import combinations
+from random import Random
+from numba import njit
+import numpy as np
+import os
+import time
+
+
+# A state of the table is the set of cards seen so far, packed in an int64 with one byte per card
+# (value+1 in the high nibble, suit+1 in the low one), sorted in decreasing order.
+# Suits which can no longer make a flush are zeroed so that suit-isomorphic states are merged.
+
+categories_sizes = [0, 1277, 2860, 858, 858, 10, 1277, 156, 156, 10]
+
+
+def _category_and_key(value_counts, flush):
+    # value_counts: list of 13 counts for a 5 card hand
+    present = [v for v in range(12, -1, -1) if value_counts[v] > 0]
+    mask = sum(1 << v for v in present)
+    straight_top = -1
+    if len(present) == 5:
+        if present[0] - present[4] == 4:
+            straight_top = present[0]
+        elif present == [12, 3, 2, 1, 0]:
+            straight_top = 3
+    if flush:
+        if straight_top >= 0:
+            return 9, straight_top
+        return 6, mask
+    if straight_top >= 0:
+        return 5, straight_top
+    by_count = sorted(present, key=lambda v: (value_counts[v], v), reverse=True)
+    counts = [value_counts[v] for v in by_count]
+    if counts == [4, 1]:
+        return 8, by_count[0] * 13 + by_count[1]
+    if counts == [3, 2]:
+        return 7, by_count[0] * 13 + by_count[1]
+    if counts == [3, 1, 1]:
+        return 4, (by_count[0] << 13) | (1 << by_count[1]) | (1 << by_count[2])
+    if counts == [2, 2, 1]:
+        return 3, ((by_count[0] * 13 + by_count[1]) << 13) | (1 << by_count[2])
+    if counts == [2, 1, 1, 1]:
+        return 2, (by_count[0] << 13) | (1 << by_count[1]) | (1 << by_count[2]) | (1 << by_count[3])
+    return 1, mask
+
+
+def _build_category_keys():
+    keys = [set() for _ in range(10)]
+
+    def rec(value, remaining, counts):
+        if remaining == 0:
+            category, key = _category_and_key(counts, False)
+            keys[category].add(key)
+            if max(counts) == 1:
+                category, key = _category_and_key(counts, True)
+                keys[category].add(key)
+            return
+        if value == 13:
+            return
+        for n in range(min(4, remaining), -1, -1):
+            counts[value] = n
+            rec(value + 1, remaining - n, counts)
+        counts[value] = 0
+
+    rec(0, 5, [0] * 13)
+    for category in range(1, 10):
+        assert len(keys[category]) == categories_sizes[category]
+    offsets = np.zeros(11, dtype=np.int64)
+    all_keys = []
+    for category in range(1, 10):
+        offsets[category + 1] = offsets[category] + len(keys[category])
+        all_keys += sorted(keys[category])
+    return np.array(all_keys, dtype=np.int64), offsets
+
+
+@njit(cache=True)
+def _rank(category_keys, offsets, category, key):
+    start = offsets[category]
+    end = offsets[category + 1]
+    return (category << 12) | (np.searchsorted(category_keys[start:end], key) + 1)
+
+
+@njit(cache=True)
+def _top_bits(mask, n):
+    result = 0
+    for v in range(12, -1, -1):
+        if n == 0:
+            break
+        if mask & (1 << v):
+            result |= 1 << v
+            n -= 1
+    return result
+
+
+@njit(cache=True)
+def _highest(mask):
+    for v in range(12, -1, -1):
+        if mask & (1 << v):
+            return v
+    return -1
+
+
+@njit(cache=True)
+def _straight_top(mask):
+    for top in range(12, 3, -1):
+        straight = 0x1f << (top - 4)
+        if mask & straight == straight:
+            return top
+    if mask & 0x100f == 0x100f:
+        return 3
+    return -1
+
+
+@njit(cache=True)
+def _eval_state(category_keys, offsets, state):
+    value_counts = np.zeros(13, dtype=np.int64)
+    suit_masks = np.zeros(5, dtype=np.int64)
+    suit_counts = np.zeros(5, dtype=np.int64)
+    for i in range(7):
+        byte = (state >> (8 * i)) & 0xff
+        if byte == 0:
+            break
+        value = (byte >> 4) - 1
+        suit = byte & 0xf
+        value_counts[value] += 1
+        suit_masks[suit] |= 1 << value
+        suit_counts[suit] += 1
+
+    flush_rank = 0
+    for suit in range(1, 5):
+        if suit_counts[suit] >= 5:
+            top = _straight_top(suit_masks[suit])
+            if top >= 0:
+                return _rank(category_keys, offsets, 9, top)
+            flush_rank = _rank(category_keys, offsets, 6, _top_bits(suit_masks[suit], 5))
+
+    quads = -1
+    trips = -1
+    second_trips = -1
+    pair = -1
+    second_pair = -1
+    mask = 0
+    for v in range(12, -1, -1):
+        c = value_counts[v]
+        if c > 0:
+            mask |= 1 << v
+        if c == 4:
+            quads = v
+        elif c == 3:
+            if trips < 0:
+                trips = v
+            elif second_trips < 0:
+                second_trips = v
+        elif c == 2:
+            if pair < 0:
+                pair = v
+            elif second_pair < 0:
+                second_pair = v
+
+    if quads >= 0:
+        return _rank(category_keys, offsets, 8, quads * 13 + _highest(mask & ~(1 << quads)))
+    if trips >= 0 and (pair >= 0 or second_trips >= 0):
+        full_pair = max(pair, second_trips)
+        return _rank(category_keys, offsets, 7, trips * 13 + full_pair)
+    if flush_rank > 0:
+        return flush_rank
+    top = _straight_top(mask)
+    if top >= 0:
+        return _rank(category_keys, offsets, 5, top)
+    if trips >= 0:
+        return _rank(category_keys, offsets, 4, (trips << 13) | _top_bits(mask & ~(1 << trips), 2))
+    if second_pair >= 0:
+        kickers = _top_bits(mask & ~(1 << pair) & ~(1 << second_pair), 1)
+        return _rank(category_keys, offsets, 3, ((pair * 13 + second_pair) << 13) | kickers)
+    if pair >= 0:
+        return _rank(category_keys, offsets, 2, (pair << 13) | _top_bits(mask & ~(1 << pair), 3))
+    return _rank(category_keys, offsets, 1, _top_bits(mask, 5))
+
+
+@njit(cache=True)
+def _make_state(state, card):
+    cards = np.zeros(8, dtype=np.int64)
+    new_card = (((card >> 2) + 1) << 4) | ((card & 3) + 1)
+    cards[0] = new_card
+    n = 1
+    for i in range(7):
+        byte = (state >> (8 * i)) & 0xff
+        if byte == 0:
+            break
+        if byte == new_card:
+            return 0
+        cards[n] = byte
+        n += 1
+    if n > 7:
+        return 0
+
+    value_counts = np.zeros(14, dtype=np.int64)
+    suit_counts = np.zeros(5, dtype=np.int64)
+    for i in range(n):
+        value_counts[cards[i] >> 4] += 1
+        suit_counts[cards[i] & 0xf] += 1
+    for v in range(14):
+        if value_counts[v] > 4:
+            return 0
+
+    need_suited = n - 2
+    if need_suited > 1:
+        for i in range(n):
+            if suit_counts[cards[i] & 0xf] < need_suited:
+                cards[i] &= 0xf0
+
+    cards[:n] = np.sort(cards[:n])[::-1]
+    result = 0
+    for i in range(n):
+        result |= cards[i] << (8 * i)
+    return result
+
+
+@njit(cache=True)
+def _children(states):
+    children = np.zeros((len(states), 52), dtype=np.int64)
+    for i in range(len(states)):
+        for card in range(52):
+            children[i, card] = _make_state(states[i], card)
+    return children
+
+
+@njit(cache=True)
+def _fill_level(rank_table, states, base, n_cards, next_states, next_base, category_keys, offsets):
+    for i in range(len(states)):
+        p = (base + i) * 53 + 53
+        if n_cards >= 5:
+            rank_table[p] = _eval_state(category_keys, offsets, states[i])
+        for card in range(52):
+            child = _make_state(states[i], card)
+            if child == 0:
+                continue
+            if n_cards < 6:
+                rank_table[p + card + 1] = (next_base + np.searchsorted(next_states, child)) * 53 + 53
+            else:
+                rank_table[p + card + 1] = _eval_state(category_keys, offsets, child)
+
+
+def build_rank_table():
+    category_keys, offsets = _build_category_keys()
+    levels = [np.zeros(1, dtype=np.int64)]
+    for n_cards in range(6):
+        children = np.unique(_children(levels[-1]))
+        levels.append(children[children != 0])
+    bases = np.cumsum([0] + [len(states) for states in levels])
+    rank_table = np.zeros(53 + bases[-1] * 53, dtype=np.int32)
+    for n_cards, states in enumerate(levels):
+        if n_cards < 6:
+            next_states, next_base = levels[n_cards + 1], bases[n_cards + 1]
+        else:
+            next_states, next_base = levels[0], 0
+        _fill_level(rank_table, states, bases[n_cards], n_cards, next_states, next_base, category_keys, offsets)
+    return rank_table
+
+
+def _brute_force_rank(cards, category_keys, offsets):
+    best = 0
+    for five in combinations(cards, 5):
+        value_counts = [0] * 13
+        for card in five:
+            value_counts[card // 4] += 1
+        flush = len(set(card % 4 for card in five)) == 1
+        category, key = _category_and_key(value_counts, flush)
+        start, end = offsets[category], offsets[category + 1]
+        rank = (category << 12) | (int(np.searchsorted(category_keys[start:end], key)) + 1)
+        best = max(best, rank)
+    return best
+
+
+def verify_rank_table(rank_table, n_hands=100_000, seed=0):
+    category_keys, offsets = _build_category_keys()
+    rng = Random(seed)
+    deck = list(range(52))
+    for i in range(n_hands):
+        n_cards = 5 + i % 3
+        cards = rng.sample(deck, n_cards)
+        p = 53
+        for card in cards:
+            p = rank_table[p + card + 1]
+        if n_cards < 7:
+            p = rank_table[p]
+        expected = _brute_force_rank(cards, category_keys, offsets)
+        if p != expected:
+            raise RuntimeError(f"rank table mismatch for {cards} : {p} != {expected}")
+
+
+def run(output='rank_table.bin', n_verify=100_000):
+    start = time.time()
+    rank_table = build_rank_table()
+    print(f"Rank table built in {time.time() - start:.1f} seconds ({len(rank_table):,} entries)")
+    start = time.time()
+    verify_rank_table(rank_table, n_verify)
+    print(f"Verified against brute force on {n_verify:,} hands in {time.time() - start:.1f} seconds")
+    rank_table.tofile(os.path.join(os.path.dirname(__file__), output))
+
+
+if __name__ == '__main__':
+    run()
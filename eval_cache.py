@@ -0,0 +1,65 @@
+from collections import OrderedDict
+import pickle
+import sqlite3
+
+
+class EvalCache:
+    # Results of on-demand evaluations keyed by (kind, parameters, generic id), where the generic id
+    # (get_generic_id) is the same for suit-isomorphic hands. The most recently used max_size entries are
+    # kept in memory ; with a path, every result is also stored in a sqlite file, which is read on a
+    # memory miss, so the results survive the process and are shared by the processes using the file.
+    def __init__(self, max_size: int=100_000, path: str=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)")
+
+    def get(self, key: tuple):
+        # Cached value, or None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.db is not None:
+            row = self.db.execute("SELECT value FROM cache WHERE key = ?", (repr(key),)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                value = pickle.loads(row[0])
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, value):
+        self._remember(key, value)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?)", (repr(key), pickle.dumps(value)))
+
+    def _remember(self, key: tuple, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,305 @@
+from math import comb
+from typing import List
+from numba import njit, prange
+import numpy as np
+
+
+# Dense index of suit-isomorphic hands (Waugh's hand isomorphism).
+# A hand is dealt in rounds (e.g. [2, 3] for pocket + flop) and cards are ints value*4 + suit.
+# For each suit, the ranks dealt in each round are colex-ranked into a suit index, suits are then
+# sorted by (number of cards per round, suit index) and suits with the same counts are ranked as a multiset.
+
+RANKS = 13
+SUITS = 4
+NO_CARD = -1
+
+# Rounds of the hands at each street : preflop, flop, turn, river
+STREETS_CARDS_PER_ROUND = [[2], [2, 3], [2, 3, 1], [2, 3, 1, 1]]
+
+
+@njit(cache=True)
+def _ncr(n: int, k: int):
+    if k < 0 or k > n:
+        return 0
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+@njit(cache=True)
+def _popcount(x: int):
+    count = 0
+    while x:
+        x &= x - 1
+        count += 1
+    return count
+
+
+@njit(cache=True)
+def _suit_sort(codes: np.ndarray, suit_index: np.ndarray, order: np.ndarray):
+    # order suits by decreasing (code, suit index), insertion sort on 4 elements
+    for i in range(SUITS):
+        order[i] = i
+    for i in range(1, SUITS):
+        j = i
+        while j > 0:
+            a = order[j - 1]
+            b = order[j]
+            if codes[a] > codes[b] or (codes[a] == codes[b] and suit_index[a] >= suit_index[b]):
+                break
+            order[j - 1] = b
+            order[j] = a
+            j -= 1
+
+
+@njit(cache=True)
+def _index(cards: np.ndarray, cards_per_round: np.ndarray, n_codes: int,
+           suit_sizes: np.ndarray, config_keys: np.ndarray, config_offsets: np.ndarray):
+    used = np.zeros(SUITS, dtype=np.int64)
+    suit_index = np.zeros(SUITS, dtype=np.int64)
+    suit_multiplier = np.ones(SUITS, dtype=np.int64)
+    codes = np.zeros(SUITS, dtype=np.int64)
+    ranks = np.zeros(SUITS, dtype=np.int64)
+    code_multiplier = 1
+    pos = 0
+    for r in range(len(cards_per_round)):
+        ranks[:] = 0
+        for _ in range(cards_per_round[r]):
+            card = cards[pos]
+            pos += 1
+            ranks[card % SUITS] |= 1 << (card // SUITS)
+        for s in range(SUITS):
+            n_used = _popcount(used[s])
+            size = 0
+            colex = 0
+            for rank in range(RANKS):
+                if ranks[s] & (1 << rank):
+                    size += 1
+                    colex += _ncr(rank - _popcount(used[s] & ((1 << rank) - 1)), size)
+            suit_index[s] += suit_multiplier[s] * colex
+            suit_multiplier[s] *= _ncr(RANKS - n_used, size)
+            used[s] |= ranks[s]
+            codes[s] += code_multiplier * size
+        code_multiplier *= cards_per_round[r] + 1
+
+    order = np.empty(SUITS, dtype=np.int64)
+    _suit_sort(codes, suit_index, order)
+    key = 0
+    for i in range(SUITS):
+        key = key * n_codes + codes[order[i]]
+    index = config_offsets[np.searchsorted(config_keys, key)]
+    multiplier = 1
+    i = 0
+    while i < SUITS:
+        code = codes[order[i]]
+        j = i
+        while j + 1 < SUITS and codes[order[j + 1]] == code:
+            j += 1
+        group_size = j - i + 1
+        part = 0
+        for k in range(group_size):
+            part += _ncr(suit_index[order[j - k]] + k, k + 1)
+        index += multiplier * part
+        multiplier *= _ncr(suit_sizes[code] + group_size - 1, group_size)
+        i = j + 1
+    return index
+
+
+@njit(cache=True)
+def _unindex(index: int, cards_per_round: np.ndarray, config_codes: np.ndarray,
+             suit_sizes: np.ndarray, config_offsets: np.ndarray, cards: np.ndarray):
+    config = np.searchsorted(config_offsets, index, side='right') - 1
+    codes = config_codes[config]
+    rest = index - config_offsets[config]
+    suit_index = np.zeros(SUITS, dtype=np.int64)
+    i = 0
+    while i < SUITS:
+        j = i
+        while j + 1 < SUITS and codes[j + 1] == codes[i]:
+            j += 1
+        group_size = j - i + 1
+        group_count = _ncr(suit_sizes[codes[i]] + group_size - 1, group_size)
+        part = rest % group_count
+        rest //= group_count
+        for k in range(group_size, 0, -1):
+            y = k - 1
+            while _ncr(y + 1, k) <= part:
+                y += 1
+            part -= _ncr(y, k)
+            suit_index[j - (k - 1)] = y - (k - 1)
+        i = j + 1
+
+    n_rounds = len(cards_per_round)
+    round_ranks = np.zeros((n_rounds, SUITS), dtype=np.int64)
+    for s in range(SUITS):
+        used = 0
+        code = codes[s]
+        rest_index = suit_index[s]
+        for r in range(n_rounds):
+            size = code % (cards_per_round[r] + 1)
+            code //= cards_per_round[r] + 1
+            n_free = RANKS - _popcount(used)
+            count = _ncr(n_free, size)
+            part = rest_index % count
+            rest_index //= count
+            shifted = 0
+            for k in range(size, 0, -1):
+                y = k - 1
+                while _ncr(y + 1, k) <= part:
+                    y += 1
+                part -= _ncr(y, k)
+                shifted |= 1 << y
+            ranks = 0
+            free = 0
+            for rank in range(RANKS):
+                if used & (1 << rank):
+                    continue
+                if shifted & (1 << free):
+                    ranks |= 1 << rank
+                free += 1
+            round_ranks[r, s] = ranks
+            used |= ranks
+
+    pos = 0
+    for r in range(n_rounds):
+        for card in range(RANKS * SUITS):
+            if round_ranks[r, card % SUITS] & (1 << (card // SUITS)):
+                cards[pos] = card
+                pos += 1
+
+
+@njit(parallel=True, cache=True)
+def _index_batch(cards: np.ndarray, cards_per_round: np.ndarray, n_codes: int,
+                 suit_sizes: np.ndarray, config_keys: np.ndarray, config_offsets: np.ndarray):
+    result = np.empty(len(cards), dtype=np.int64)
+    for i in prange(len(cards)):
+        result[i] = _index(cards[i], cards_per_round, n_codes, suit_sizes, config_keys, config_offsets)
+    return result
+
+
+@njit(parallel=True, cache=True)
+def _unindex_batch(indices: np.ndarray, cards_per_round: np.ndarray, config_codes: np.ndarray,
+                   suit_sizes: np.ndarray, config_offsets: np.ndarray):
+    cards = np.empty((len(indices), cards_per_round.sum()), dtype=np.int64)
+    for i in prange(len(indices)):
+        _unindex(indices[i], cards_per_round, config_codes, suit_sizes, config_offsets, cards[i])
+    return cards
+
+
+class HandIndexer:
+    def __init__(self, cards_per_round: List[int]):
+        self.cards_per_round = np.array(cards_per_round, dtype=np.int64)
+
+        # A suit code encodes the number of cards of the suit in each round (mixed radix)
+        n_rounds = len(cards_per_round)
+        self.n_codes = int(np.prod(self.cards_per_round + 1))
+        code_counts = []
+        self.suit_sizes = np.zeros(self.n_codes, dtype=np.int64)
+        for code in range(self.n_codes):
+            counts = []
+            rest = code
+            for r in range(n_rounds):
+                counts.append(rest % (cards_per_round[r] + 1))
+                rest //= cards_per_round[r] + 1
+            code_counts.append(counts)
+            size = 1
+            n_used = 0
+            for count in counts:
+                size *= comb(RANKS - n_used, count)
+                n_used += count
+            self.suit_sizes[code] = size
+
+        # A configuration is the decreasing tuple of the 4 suit codes
+        config_codes = []
+
+        def add_configurations(codes, totals):
+            if len(codes) == SUITS:
+                if totals == list(cards_per_round):
+                    config_codes.append(tuple(codes))
+                return
+            for code in range(codes[-1] if codes else self.n_codes - 1, -1, -1):
+                new_totals = [total + count for total, count in zip(totals, code_counts[code])]
+                if all(total <= limit for total, limit in zip(new_totals, cards_per_round)):
+                    add_configurations(codes + [code], new_totals)
+
+        add_configurations([], [0] * n_rounds)
+        config_codes.sort(key=self._config_key)
+        self.config_codes = np.array(config_codes, dtype=np.int64)
+        self.config_keys = np.array([self._config_key(codes) for codes in config_codes], dtype=np.int64)
+        self.config_offsets = np.zeros(len(config_codes) + 1, dtype=np.int64)
+        for i, codes in enumerate(config_codes):
+            count = 1
+            for code in set(codes):
+                group_size = codes.count(code)
+                count *= comb(int(self.suit_sizes[code]) + group_size - 1, group_size)
+            self.config_offsets[i + 1] = self.config_offsets[i] + count
+        self.size = int(self.config_offsets[-1])
+
+    def _config_key(self, codes):
+        key = 0
+        for code in codes:
+            key = key * self.n_codes + code
+        return key
+
+    def index(self, cards: np.ndarray):
+        return _index(np.asarray(cards, dtype=np.int64), self.cards_per_round, self.n_codes,
+                      self.suit_sizes, self.config_keys, self.config_offsets)
+
+    def index_batch(self, cards: np.ndarray):
+        return _index_batch(np.asarray(cards, dtype=np.int64), self.cards_per_round, self.n_codes,
+                            self.suit_sizes, self.config_keys, self.config_offsets)
+
+    def unindex(self, index: int):
+        cards = np.empty(self.cards_per_round.sum(), dtype=np.int64)
+        _unindex(index, self.cards_per_round, self.config_codes, self.suit_sizes, self.config_offsets, cards)
+        return cards
+
+    def unindex_batch(self, indices: np.ndarray):
+        return _unindex_batch(np.asarray(indices, dtype=np.int64), self.cards_per_round, self.config_codes,
+                              self.suit_sizes, self.config_offsets)
+
+
+class StreetIndexer:
+    # Dense id of suit-isomorphic hands of any street (pocket, then flop, turn and river cards).
+    # Street s uses the ids [offsets[s], offsets[s+1]), so the ids of all streets are contiguous.
+    def __init__(self):
+        self.indexers = [HandIndexer(cards_per_round) for cards_per_round in STREETS_CARDS_PER_ROUND]
+        self.offsets = np.cumsum([0] + [indexer.size for indexer in self.indexers])
+        self.size = int(self.offsets[-1])
+
+    def streets(self, cards: np.ndarray):
+        # cards : int array (N, 7) padded with NO_CARD, returns the street of each row
+        n_cards = (np.asarray(cards) != NO_CARD).sum(axis=1)
+        streets = np.searchsorted([2, 5, 6, 7], n_cards)
+        if not np.isin(n_cards, [2, 5, 6, 7]).all():
+            raise RuntimeError("invalid hand size")
+        return streets
+
+    def index_batch(self, cards: np.ndarray):
+        cards = np.asarray(cards, dtype=np.int64)
+        streets = self.streets(cards)
+        ids = np.empty(len(cards), dtype=np.int64)
+        for street, indexer in enumerate(self.indexers):
+            rows = np.nonzero(streets == street)[0]
+            if len(rows) > 0:
+                n_cards = indexer.cards_per_round.sum()
+                ids[rows] = self.offsets[street] + indexer.index_batch(cards[rows, :n_cards])
+        return ids
+
+    def unindex_batch(self, ids: np.ndarray):
+        # Inverse of index_batch : the canonical hand of each id, padded with NO_CARD
+        ids = np.asarray(ids, dtype=np.int64)
+        streets = np.searchsorted(self.offsets, ids, side='right') - 1
+        cards = np.full((len(ids), 7), NO_CARD, dtype=np.int64)
+        for street, indexer in enumerate(self.indexers):
+            rows = np.nonzero(streets == street)[0]
+            if len(rows) > 0:
+                n_cards = indexer.cards_per_round.sum()
+                cards[rows, :n_cards] = indexer.unindex_batch(ids[rows] - self.offsets[street])
+        return cards
+
+    def canonicalize_batch(self, cards: np.ndarray):
+        # Returns the canonical hands and their ids
+        ids = self.index_batch(cards)
+        return self.unindex_batch(ids), ids
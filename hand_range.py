@@ -0,0 +1,107 @@
+from typing import List
+import numpy as np
+from poker_eval import Card, POCKETS, POCKET_IDS, values, suits, str_to_cards
+
+
+# A range is a weight for each of the 1326 pockets (see POCKETS).
+# Ranges are written as comma separated groups with an optional weight, e.g. "22+, ATs+, KQo:0.5, AhKh" :
+#   AA, AKs, AKo, AK    pair, suited, offsuit and all combos of two values
+#   22+, ATs+, K9o+     pairs from 22 up to AA, kicker from T up to K (below the first card)
+#   22-55, A2s-A5s      pairs or kickers between the two bounds
+#   AhKh                a single combo
+
+
+def _value(char: str):
+    if char not in values:
+        raise RuntimeError(f"invalid card value {char}")
+    return values.index(char)
+
+
+def _combos(value1: int, value2: int, suitedness: str):
+    # Pocket ids of the combos of two values, suitedness is 's', 'o' or '' for both
+    result = []
+    for suit1 in range(4):
+        for suit2 in range(4):
+            card1 = value1 * 4 + suit1
+            card2 = value2 * 4 + suit2
+            if card1 == card2 or (value1 == value2 and suit1 > suit2):
+                continue
+            if suitedness == 's' and suit1 != suit2 or suitedness == 'o' and suit1 == suit2:
+                continue
+            result.append(POCKET_IDS[card1, card2])
+    return result
+
+
+def _parse_group(group: str):
+    # Pocket ids of a group of combos
+    if len(group) == 4 and group[1] in suits and group[3] in suits:
+        cards = str_to_cards(group)
+        if cards[0] == cards[1]:
+            raise RuntimeError(f"invalid range group {group}")
+        return [POCKET_IDS[cards[0].idx, cards[1].idx]]
+    if '-' in group:
+        low, high = group.split('-')
+    elif group.endswith('+'):
+        low = group[:-1]
+        high = None
+    else:
+        low = high = group
+    if len(low) not in (2, 3) or len(low) == 3 and low[2] not in 'so':
+        raise RuntimeError(f"invalid range group {group}")
+    value1 = _value(low[0])
+    value2 = _value(low[1])
+    suitedness = low[2:]
+    if value1 == value2:
+        if high is not None and (len(high) != 2 or high[0] != high[1]):
+            raise RuntimeError(f"invalid range group {group}")
+        high_value = values.index('a') if high is None else _value(high[0])
+        # spans are accepted in both orders, 55-22 is 22-55
+        value1, high_value = min(value1, high_value), max(value1, high_value)
+        return [combo for value in range(value1, high_value + 1) for combo in _combos(value, value, suitedness)]
+    value1, value2 = max(value1, value2), min(value1, value2)
+    if high is None:
+        high_value = value1 - 1
+    else:
+        if high[2:] != suitedness or _value(high[0]) != value1:
+            raise RuntimeError(f"invalid range group {group}")
+        high_value = _value(high[1])
+        value2, high_value = min(value2, high_value), max(value2, high_value)
+    return [combo for kicker in range(value2, high_value + 1) for combo in _combos(value1, kicker, suitedness)]
+
+
+class Range:
+    def __init__(self, weights: np.ndarray=None):
+        self.weights = np.zeros(len(POCKETS)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    @classmethod
+    def from_str(cls, s: str):
+        hand_range = cls()
+        for group in s.replace(' ', '').lower().split(','):
+            if group == '':
+                continue
+            weight = 1.
+            if ':' in group:
+                group, weight = group.split(':')
+                weight = float(weight)
+            hand_range.weights[_parse_group(group)] = weight
+        return hand_range
+
+    @classmethod
+    def from_pockets(cls, pockets: List[List[Card]], weight: float=1.):
+        hand_range = cls()
+        for pocket in pockets:
+            hand_range.weights[POCKET_IDS[pocket[0].idx, pocket[1].idx]] = weight
+        return hand_range
+
+    @classmethod
+    def full(cls):
+        return cls(np.ones(len(POCKETS)))
+
+    def __len__(self):
+        # number of combos with a non zero weight
+        return int(np.count_nonzero(self.weights))
+
+    def pockets(self):
+        # (N, 2) int array of the combos with a non zero weight, and their weights
+        ids = np.nonzero(self.weights)[0]
+        return POCKETS[ids], self.weights[ids]
@@ -0,0 +1,128 @@
+from random import Random
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+from poker_cards import Card, cards_to_str_bis
+from lookup_client import AsyncLookupClient
+from lookup_store import LookupStore
+
+
+# Load test of lookup_api : n_requests requests (single lookups, or POST /lookup of batch_size hands) sent by
+# concurrency tasks through an AsyncLookupClient whose cache is disabled, so that every hand reaches the server.
+# Hands are random, or drawn from a database file to measure the lookups only.
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STREET_SIZES = (0, 3, 4, 5)
+
+
+def random_hands(rng: Random, n_hands: int):
+    hands = []
+    for _ in range(n_hands):
+        cards = [cards_to_str_bis([Card(card)]) for card in rng.sample(range(52), 7)]
+        board_size = rng.choice(STREET_SIZES)
+        hands.append(("".join(cards[:2]), "".join(cards[2:min(board_size, 3) + 2]),
+                      cards[5] if board_size >= 4 else "", cards[6] if board_size == 5 else ""))
+    return hands
+
+
+def database_hands(rng: Random, n_hands: int, dbpath: str):
+    db = LookupStore.load(dbpath)
+    rows = [db.row(position) for position in rng.choices(range(len(db)), k=n_hands)]
+    return [(row['Pocket'], row['Table'], row['Turn'], row['River']) for row in rows]
+
+
+async def send(client: AsyncLookupClient, requests, latencies: list, sources: dict, errors: list):
+    # requests : iterator shared by the tasks, each item is the list of hands of a request
+    for hands in requests:
+        start = time.perf_counter()
+        try:
+            rows = await client.lookup_batch(hands) if len(hands) > 1 else [await client.lookup(*hands[0])]
+        except httpx.HTTPError as error:
+            errors.append(repr(error))
+            continue
+        latencies.append(time.perf_counter() - start)
+        for row in rows:
+            sources[row['source']] = sources.get(row['source'], 0) + 1
+
+
+async def load_test(url, hands, batch_size: int, concurrency: int, budget: float=None):
+    requests = iter([hands[start:start + batch_size] for start in range(0, len(hands), batch_size)])
+    latencies = []
+    sources = {}
+    errors = []
+    async with AsyncLookupClient(url, cache_size=0, budget=budget, timeout=60., max_connections=concurrency) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(send(client, requests, latencies, sources, errors) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+    latencies = np.array(latencies)
+    return {
+        'requests': len(latencies),
+        'hands': sum(sources.values()),
+        'errors': len(errors),
+        'duration': duration,
+        'requests_per_s': len(latencies) / duration,
+        'hands_per_s': sum(sources.values()) / duration,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1e3 if len(latencies) else None,
+        'p90_ms': float(np.percentile(latencies, 90)) * 1e3 if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1e3 if len(latencies) else None,
+        'sources': sources,
+    }
+
+
+def start_server(port: int, timeout: float=300.):
+    # uvicorn lookup_api:app in the current directory (where the database file is), returns once it answers
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'lookup_api:app', '--app-dir', DIRECTORY,
+                               '--port', str(port), '--log-level', 'warning'])
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("lookup_api did not start")
+        try:
+            httpx.get(f"http://localhost:{port}/openapi.json").raise_for_status()
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("lookup_api did not start in time")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default="http://localhost:8000")
+    parser.add_argument('--start-server', action='store_true', help="run uvicorn lookup_api:app for the test")
+    parser.add_argument('--n-requests', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=1, help="hands per request, POST /lookup when > 1")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--budget', type=float, help="budget query parameter of the requests")
+    parser.add_argument('--db', help="database file to draw the hands from, instead of random hands")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="json file of the results")
+    args = parser.parse_args()
+
+    rng = Random(args.seed)
+    n_hands = args.n_requests * args.batch_size
+    hands = database_hands(rng, n_hands, args.db) if args.db else random_hands(rng, n_hands)
+    server = None
+    if args.start_server:
+        port = int(args.url.rsplit(':', 1)[1])
+        server = start_server(port)
+    try:
+        results = asyncio.run(load_test(args.url, hands, args.batch_size, args.concurrency, args.budget))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(f"{results['requests']} requests ({results['hands']} hands, {results['errors']} errors) "
+          f"in {results['duration']:.2f} s : {results['requests_per_s']:,.0f} requests/s, {results['hands_per_s']:,.0f} hands/s")
+    if results['requests']:
+        print(f"latency p50 {results['p50_ms']:.2f} ms  p90 {results['p90_ms']:.2f} ms  p99 {results['p99_ms']:.2f} ms")
+    print("sources :", results['sources'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,13 +1,19 @@
-
+import sys
 import pandas as pd
-from poker_eval import str_to_cards_bis, get_generic_id
+from poker_cards import str_to_cards_bis, get_generic_id
+from lookup_store import LookupStore
 
 
 def run(pocket, flop, turn, river, dbpath):
     hand = str_to_cards_bis(pocket + flop + turn + river)
     generic_id = get_generic_id(hand)
-    db = pd.read_csv(dbpath)
-    print(db[db['generic_id'] == generic_id].iloc[0])
+    db = LookupStore.load(dbpath, drop=())
+    row = db.lookup(generic_id)
+    if row is None:
+        print(f"{pocket} {flop} {turn} {river} (generic id {generic_id}) not found in {dbpath}")
+        return False
+    print(pd.Series(row))
+    return True
 
 
 if __name__ == '__main__':
@@ -15,4 +21,5 @@ if __name__ == '__main__':
     flop = '6c12s10h'
     turn = ''
     river = ''
-    run(pocket, flop, turn, river, dbpath='dbg_260123_filtered_with_probs.csv')
\ No newline at end of file
+    if not run(pocket, flop, turn, river, dbpath='dbg_260123_filtered_with_probs.columnar'):
+        sys.exit(1)
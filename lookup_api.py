@@ -1,26 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import asyncio
+import os
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from poker_cards import str_to_cards_bis, cards_to_str_bis, get_generic_id
+from lookup_store import LookupStore
+from eval_cache import EvalCache
 
-from fastapi import FastAPI
-import pandas as pd
-from poker_eval import str_to_cards_bis, get_generic_id
+dbpath = "dbg_260123_filtered_with_probs.columnar"
+db = LookupStore.load(dbpath)
 
-dbpath = "dbg_260123_filtered_with_probs.csv"
-db = pd.read_csv(dbpath)
-db = db.drop(['generic_table', 'generic_turn', 'generic_river', 'generic_pocket'], axis=1)
+# Hands missing from the database are evaluated by N_WORKERS processes. A request waits at most
+# LATENCY_BUDGET seconds for the exact result, then gets a Monte Carlo estimate computed by a separate
+# worker within ESTIMATE_TIME seconds per street (the exact evaluation goes on and is cached).
+# When the estimate worker is busy, the request waits at most ESTIMATE_BUDGET seconds for its estimate,
+# then gets a row with the source 'pending' and no odds.
+N_WORKERS = os.cpu_count()
+LATENCY_BUDGET = 0.5
+ESTIMATE_TIME = 0.05
+ESTIMATE_BUDGET = 0.25
+
+# Number of cards of the pocket, flop, turn and river
+STREET_SIZES = (2, 3, 1, 1)
 
 app = FastAPI()
+pool = None
+fast_pool = None
+# generic_id -> future of the evaluation, so that concurrent requests for a hand share it
+pending = {}
+computed = EvalCache(max_size=100_000)
+
+STAGES = ('flop', 'turn', 'river')
+
+
+class Hand(BaseModel):
+    pocket: str
+    flop: str = ""
+    turn: str = ""
+    river: str = ""
+
+
+# Evaluator of the worker process, created once by init_worker. poker_eval (numba) is only imported
+# by the workers, the main process answers the database hits with the pure-Python card functions.
+_evaluator = None
+
+
+def init_worker():
+    # The tables are loaded and the kernels compiled (or loaded from the numba cache) before the first request
+    global _evaluator
+    import numba
+    from poker_eval import Evaluator, precomputed_tables_exist
+    numba.set_num_threads(1)
+    _evaluator = Evaluator(precomputed=precomputed_tables_exist())
+    evaluate_hand("14s14d", "2c3c4c", "5c", "6c")
+    evaluate_hand("14s14d", "2c3c4c", "5c", "6c", ESTIMATE_TIME)
+
+
+def warm_up():
+    return os.getpid()
+
+
+def evaluate_hand(pocket, flop, turn, river, estimate_time=None):
+    # Row with the same columns as the database ones. With estimate_time, the odds after the preflop
+    # are Monte Carlo estimates computed within estimate_time seconds per street
+    from poker_eval import HandSession
+    row = {'Pocket': pocket, 'Table': flop or "-", 'Turn': turn or "-", 'River': river or "-"}
+    session = HandSession(_evaluator, pocket, bis_formatting=True)
+    row['generic_id'] = get_generic_id(session.pocket)
+    row['proba_win_preflop'], row['proba_draw_preflop'] = (float(odds) for odds in session.odds())
+    for stage in STAGES:
+        row['best_hand_' + stage] = "-"
+        for column in ('checker', 'proba_win', 'proba_draw'):
+            row[column + '_' + stage] = ""
+    for stage, cards in zip(STAGES, (flop, turn, river)):
+        if cards == "":
+            break
+        session.deal(cards)
+        row['generic_id'] = get_generic_id(session.pocket + session.board)
+        row['best_hand_' + stage] = _evaluator.rank_to_str(session.rank())
+        row['checker_' + stage] = session.checker()
+        if estimate_time is None:
+            prob_win, prob_draw = session.odds()
+        else:
+            prob_win, prob_draw, _, _ = _evaluator.check_odds_monte_carlo(session.pocket, session.board,
+                                                                          time_budget=estimate_time)
+        row['proba_win_' + stage] = float(prob_win)
+        row['proba_draw_' + stage] = float(prob_draw)
+    row['source'] = 'computed' if estimate_time is None else 'estimate'
+    return row
+
+
+@app.on_event("startup")
+async def start_pools():
+    global pool, fast_pool
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(N_WORKERS, initializer=init_worker)
+    fast_pool = ProcessPoolExecutor(1, initializer=init_worker)
+    await asyncio.gather(*(loop.run_in_executor(pool, warm_up) for _ in range(N_WORKERS)),
+                         loop.run_in_executor(fast_pool, warm_up))
+
+
+@app.on_event("shutdown")
+def stop_pools():
+    pool.shutdown(cancel_futures=True)
+    fast_pool.shutdown(cancel_futures=True)
+
+
+def clean_cards(pocket, flop, turn, river):
+    return tuple("" if cards == "-" else cards for cards in (pocket, flop, turn, river))
+
+
+def parse_hand(pocket, flop, turn, river):
+    # Cleaned card strings and cards of the hand, ValueError unless the streets dealt so far are complete,
+    # the cards valid and distinct and the strings have nothing else
+    streets = clean_cards(pocket, flop, turn, river)
+    cards = []
+    for i, (street, size) in enumerate(zip(streets, STREET_SIZES)):
+        street_cards = str_to_cards_bis(street)
+        if cards_to_str_bis(street_cards) != street:
+            raise ValueError("invalid hand")
+        if (i == 0 or street != "") and (len(street_cards) != size or i > 0 and streets[i - 1] == ""):
+            raise ValueError("invalid hand")
+        cards += street_cards
+    if any(not 0 <= card.idx < 52 for card in cards) or len({card.idx for card in cards}) != len(cards):
+        raise ValueError("invalid hand")
+    return streets, cards
+
+
+def finish_evaluation(generic_id, future):
+    del pending[generic_id]
+    if not future.cancelled() and future.exception() is None:
+        computed.put(('row', generic_id), future.result())
+
+
+async def evaluate(streets, cards, budget):
+    generic_id = get_generic_id(cards)
+    result = db.lookup(generic_id)
+    if result is not None:
+        return dict(result, source='database')
+    result = computed.get(('row', generic_id))
+    if result is not None:
+        return result
+
+    loop = asyncio.get_running_loop()
+    future = pending.get(generic_id)
+    if future is None:
+        future = loop.run_in_executor(pool, evaluate_hand, *streets)
+        pending[generic_id] = future
+        future.add_done_callback(lambda future: finish_evaluation(generic_id, future))
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), budget)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        # cancelled while queued when the budget runs out, so that the estimates do not pile up
+        return await asyncio.wait_for(loop.run_in_executor(fast_pool, evaluate_hand, *streets, ESTIMATE_TIME),
+                                      ESTIMATE_BUDGET)
+    except asyncio.TimeoutError:
+        pocket, flop, turn, river = streets
+        return {'Pocket': pocket, 'Table': flop or "-", 'Turn': turn or "-", 'River': river or "-",
+                'generic_id': generic_id, 'source': 'pending'}
+
+
+async def evaluate_or_error(pocket, flop, turn, river, budget):
+    try:
+        streets, cards = parse_hand(pocket, flop, turn, river)
+        return await evaluate(streets, cards, budget)
+    except (ValueError, IndexError, RuntimeError):
+        raise HTTPException(status_code=400, detail="invalid hand")
+
 
 @app.get("/lookup/{pocket}/{flop}/{turn}/{river}")
-def lookup(pocket, flop, turn, river):
-    if pocket == "-":
-        pocket = ""
-    if flop == "-":
-        flop = ""
-    if turn == "-":
-        turn = ""
-    if river == "-":
-        river = ""
-    hand = str_to_cards_bis(pocket + flop + turn + river)
-    generic_id = get_generic_id(hand)
-    result = db[db['generic_id'] == generic_id].iloc[0]
-    result = result.fillna('')
-    return result.to_dict()
\ No newline at end of file
+async def lookup(pocket, flop, turn, river, budget: float=LATENCY_BUDGET):
+    return await evaluate_or_error(pocket, flop, turn, river, budget)
+
+
+@app.post("/lookup")
+async def lookup_batch(hands: List[Hand], budget: float=LATENCY_BUDGET):
+    # One row per hand, in the same order
+    return await asyncio.gather(*(evaluate_or_error(hand.pocket, hand.flop, hand.turn, hand.river, budget) for hand in hands))
@@ -1,15 +1,148 @@
+from typing import Iterable, Tuple
+import asyncio
 import requests
+from poker_cards import str_to_cards_bis, get_generic_id
+from eval_cache import EvalCache
+
+URL = "http://localhost:8000"
+# Hands sent per POST /lookup request by lookup_batch
+MAX_BATCH = 500
+
+
+# Clients of lookup_api. A connection is kept alive between the requests, and the rows are cached by the
+# generic id of the hand like on the server, so suit-isomorphic hands share their entry. Monte Carlo
+# estimates and pending rows (sources 'estimate' and 'pending') are not cached : the next request gets the exact row.
+# Hands are (pocket, flop, turn, river) strings in the database formatting ("14s14d", "2c3c4c", "5c", ""),
+# with "" or "-" for the streets not dealt yet.
+
+class _BaseLookupClient:
+    def __init__(self, url: str=URL, cache_size: int=10_000, budget: float=None):
+        # budget : seconds the server waits for the exact evaluation of a hand missing from the database
+        self.url = url
+        self.cache = EvalCache(max_size=cache_size)
+        self.params = {} if budget is None else {'budget': budget}
+
+    @staticmethod
+    def _clean(hand: Tuple[str, ...]):
+        pocket, flop, turn, river = ("" if cards == "-" else cards for cards in hand)
+        return pocket, flop, turn, river
+
+    def _key(self, hand: Tuple[str, ...]):
+        return ('row', get_generic_id(str_to_cards_bis("".join(self._clean(hand)))))
+
+    def _path(self, hand: Tuple[str, ...]):
+        return f"{self.url}/lookup/" + "/".join(cards or "-" for cards in self._clean(hand))
+
+    def _remember(self, key: tuple, row: dict):
+        if row['source'] in ('database', 'computed'):
+            self.cache.put(key, row)
+
+    def _missing(self, hands: Iterable[Tuple[str, ...]]):
+        # Keys of the hands, rows found in the cache (None otherwise), and the batches of the other hands
+        # (one hand per key) as (keys, json) pairs
+        keys = [self._key(hand) for hand in hands]
+        rows = [self.cache.get(key) for key in keys]
+        missing = {}
+        for hand, key, row in zip(hands, keys, rows):
+            if row is None and key not in missing:
+                pocket, flop, turn, river = self._clean(hand)
+                missing[key] = {'pocket': pocket, 'flop': flop, 'turn': turn, 'river': river}
+        missing = list(missing.items())
+        batches = []
+        for start in range(0, len(missing), MAX_BATCH):
+            batch = missing[start:start + MAX_BATCH]
+            batches.append(([key for key, _ in batch], [hand for _, hand in batch]))
+        return keys, rows, batches
+
+    def _fill(self, keys, rows, results: dict):
+        return [results[key] if row is None else row for key, row in zip(keys, rows)]
+
+
+class LookupClient(_BaseLookupClient):
+    def __init__(self, url: str=URL, cache_size: int=10_000, budget: float=None, timeout: float=10.):
+        super().__init__(url, cache_size, budget)
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def lookup(self, pocket: str, flop: str="", turn: str="", river: str=""):
+        key = self._key((pocket, flop, turn, river))
+        row = self.cache.get(key)
+        if row is None:
+            response = self.session.get(self._path((pocket, flop, turn, river)), params=self.params, timeout=self.timeout)
+            response.raise_for_status()
+            row = response.json()
+            self._remember(key, row)
+        return row
+
+    def lookup_batch(self, hands: Iterable[Tuple[str, str, str, str]]):
+        # One row per hand, in the same order, with one request per MAX_BATCH hands missing from the cache
+        hands = list(hands)
+        keys, rows, batches = self._missing(hands)
+        results = {}
+        for batch_keys, batch in batches:
+            response = self.session.post(f"{self.url}/lookup", json=batch, params=self.params, timeout=self.timeout)
+            response.raise_for_status()
+            for key, row in zip(batch_keys, response.json()):
+                self._remember(key, row)
+                results[key] = row
+        return self._fill(keys, rows, results)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncLookupClient(_BaseLookupClient):
+    # Same interface with coroutines, the concurrent lookups share a pool of max_connections connections
+    def __init__(self, url: str=URL, cache_size: int=10_000, budget: float=None, timeout: float=10.,
+                 max_connections: int=100):
+        # imported here so that the synchronous client does not need httpx
+        import httpx
+        super().__init__(url, cache_size, budget)
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.session = httpx.AsyncClient(timeout=timeout, limits=limits)
+
+    async def lookup(self, pocket: str, flop: str="", turn: str="", river: str=""):
+        key = self._key((pocket, flop, turn, river))
+        row = self.cache.get(key)
+        if row is None:
+            response = await self.session.get(self._path((pocket, flop, turn, river)), params=self.params)
+            response.raise_for_status()
+            row = response.json()
+            self._remember(key, row)
+        return row
+
+    async def lookup_batch(self, hands: Iterable[Tuple[str, str, str, str]]):
+        hands = list(hands)
+        keys, rows, batches = self._missing(hands)
+        responses = await asyncio.gather(*(self.session.post(f"{self.url}/lookup", json=batch, params=self.params)
+                                           for _, batch in batches))
+        results = {}
+        for (batch_keys, _), response in zip(batches, responses):
+            response.raise_for_status()
+            for key, row in zip(batch_keys, response.json()):
+                self._remember(key, row)
+                results[key] = row
+        return self._fill(keys, rows, results)
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
 
 def run(pocket, flop, turn, river):
-    if pocket == "":
-        pocket = "-"
-    if flop == "":
-        flop = "-"
-    if turn == "":
-        turn = "-"
-    if river == "":
-        river = "-"
-    result = requests.get(f"http://localhost:8000/lookup/{pocket}/{flop}/{turn}/{river}").json()
+    with LookupClient() as client:
+        result = client.lookup(pocket, flop, turn, river)
     for key in result:
         blank = " " * (17-len(key))
         print(f"{key} : {blank} {result[key]}")
@@ -0,0 +1,132 @@
+from typing import Iterable
+import json
+import numpy as np
+import pandas as pd
+
+
+# Binary columnar file : magic, header size (uint64), json header, then each column as a raw array
+# aligned on ALIGNMENT bytes. Object columns with at most 256 distinct values are stored as uint8
+# codes with their categories in the header, the other ones as fixed-width bytes.
+MAGIC = b'PKDB'
+ALIGNMENT = 64
+DROPPED_COLUMNS = ('generic_table', 'generic_turn', 'generic_river', 'generic_pocket')
+
+
+class LookupStore:
+    # Rows of the filtered-with-probs database as columns sorted by generic_id,
+    # a lookup is a binary search (np.searchsorted) on the generic_id column.
+    def __init__(self, columns: dict, categories: dict=None):
+        self.columns = columns
+        self.categories = categories or {}
+        self.ids = columns['generic_id']
+
+    @classmethod
+    def from_csv(cls, path, drop=DROPPED_COLUMNS):
+        df = pd.read_csv(path)
+        df = df.drop(list(drop), axis=1)
+        df = df.drop_duplicates(subset=['generic_id'], keep='first')
+        df = df.sort_values('generic_id', kind='stable')
+        return cls({column: df[column].to_numpy() for column in df.columns})
+
+    @classmethod
+    def load(cls, path, drop=DROPPED_COLUMNS):
+        # Memory-maps a file written by save, the cost does not depend on the size of the database
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise RuntimeError(f"{path} is not a lookup store file")
+            header_size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_size))
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        columns = {}
+        categories = {}
+        for column in header['columns']:
+            if column['name'] in drop:
+                continue
+            dtype = np.dtype(column['dtype'])
+            start = column['offset']
+            columns[column['name']] = data[start:start + header['n_rows'] * dtype.itemsize].view(dtype)
+            if 'categories' in column:
+                categories[column['name']] = column['categories']
+        return cls(columns, categories)
+
+    def save(self, path):
+        n_rows = len(self.ids)
+        arrays = []
+        header_columns = []
+        for name, values in self.columns.items():
+            column = {'name': name}
+            if name in self.categories:
+                column['categories'] = self.categories[name]
+            elif values.dtype == object:
+                values = np.array(['' if isinstance(value, float) else value for value in values], dtype=object)
+                uniques, codes = np.unique(values.astype(str), return_inverse=True)
+                if len(uniques) <= 256:
+                    column['categories'] = uniques.tolist()
+                    values = codes.reshape(-1).astype(np.uint8)
+                else:
+                    values = values.astype(str).astype(bytes)
+            values = np.ascontiguousarray(values)
+            column['dtype'] = values.dtype.str
+            arrays.append(values)
+            header_columns.append(column)
+
+        # Offsets depend on the header size, which depends on the offsets : reserve room for them first
+        header = {'n_rows': n_rows, 'columns': header_columns}
+        for column in header_columns:
+            column['offset'] = 0
+        header_size = len(json.dumps(header).encode()) + 32 * len(header_columns)
+        offset = len(MAGIC) + 8 + header_size
+        for column, values in zip(header_columns, arrays):
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            column['offset'] = offset
+            offset += values.nbytes
+        header_bytes = json.dumps(header).encode().ljust(header_size)
+
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(header_size.to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for column, values in zip(header_columns, arrays):
+                f.write(b'\0' * (column['offset'] - f.tell()))
+                f.write(values.tobytes())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, generic_ids: Iterable[int]):
+        # Positions of the generic ids in the store, -1 when missing
+        generic_ids = np.asarray(generic_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, generic_ids)
+        positions = np.minimum(positions, len(self.ids) - 1)
+        found = self.ids[positions] == generic_ids if len(self.ids) > 0 else np.zeros(len(generic_ids), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def row(self, position: int):
+        # Same content as the DataFrame row with NaN replaced by ''
+        result = {}
+        for column, values in self.columns.items():
+            value = values[position]
+            if column in self.categories:
+                value = self.categories[column][value]
+            elif isinstance(value, bytes):
+                value = value.decode()
+            elif isinstance(value, (float, np.floating)) and np.isnan(value):
+                value = ''
+            elif isinstance(value, np.generic):
+                value = value.item()
+            result[column] = value
+        return result
+
+    def lookup(self, generic_id: int):
+        position = self.find([generic_id])[0]
+        if position < 0:
+            return None
+        return self.row(position)
+
+    def lookup_batch(self, generic_ids: Iterable[int]):
+        return [self.row(position) if position >= 0 else None for position in self.find(list(generic_ids))]
+
+
+def export_columnar(csv_path, output):
+    # Converts the filtered-with-probs csv database to the binary columnar format
+    LookupStore.from_csv(csv_path, drop=()).save(output)
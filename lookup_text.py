@@ -1,27 +1,77 @@
-
 import pandas as pd
-from poker_eval import str_to_cards_bis, get_generic_id
+from poker_cards import str_to_cards_bis, get_generic_id
+from lookup_store import LookupStore
+from eval_cache import EvalCache
 import json
 import time
 import os
 
-clear = lambda: os.system('cls')
-
-def run(dbpath):
-    db = pd.read_csv(dbpath)
-    db = db.drop(['generic_table', 'generic_turn', 'generic_river', 'generic_pocket'], axis=1)
-    while True:
-        hand = json.loads(open('hand.json').read())
-        try:
-            hand = str_to_cards_bis(hand['pocket'] + hand['flop'] + hand['turn'] + hand['river'])
-            generic_id = get_generic_id(hand)
-            clear()
-            print(db[db['generic_id'] == generic_id].iloc[0])
-        except KeyboardInterrupt:
-            return
-        except:
-            pass
-        time.sleep(0.05)
+try:
+    # installed with uvicorn[standard], reports the changes of the file through inotify (or the OS equivalent)
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+# Without watchfiles, the modification time of the file is checked every POLL_INTERVAL seconds
+POLL_INTERVAL = 0.005
+CLEAR = '\033[2J\033[H'
+
+
+def changes(path):
+    # Yields once at start, then whenever the file may have changed
+    yield
+    if watchfiles is not None:
+        path = os.path.abspath(path)
+        # the directory is watched, editors often replace the file instead of writing into it
+        for _ in watchfiles.watch(os.path.dirname(path), watch_filter=lambda change, changed: changed == path,
+                                  step=1, recursive=False):
+            yield
+    else:
+        last_stat = None
+        while True:
+            try:
+                stat = os.stat(path)
+                stat = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                stat = None
+            if stat != last_stat:
+                last_stat = stat
+                yield
+            time.sleep(POLL_INTERVAL)
+
+
+def read_generic_id(path):
+    with open(path) as f:
+        hand = json.load(f)
+    return get_generic_id(str_to_cards_bis(hand['pocket'] + hand['flop'] + hand['turn'] + hand['river']))
+
+
+def run(dbpath, path='hand.json'):
+    db = LookupStore.load(dbpath)
+    # generic_id -> displayed text of the recently looked up hands
+    texts = EvalCache(max_size=1000)
+    if os.name == 'nt':
+        # enables the escape sequences in the Windows console
+        os.system('')
+    shown = None
+    try:
+        for _ in changes(path):
+            try:
+                generic_id = read_generic_id(path)
+            except (OSError, ValueError, KeyError, IndexError):
+                # missing file, file being written or invalid hand
+                continue
+            if generic_id == shown:
+                continue
+            text = texts.get(('text', generic_id))
+            if text is None:
+                row = db.lookup(generic_id)
+                text = f"{generic_id} is not in the database" if row is None else str(pd.Series(row))
+                texts.put(('text', generic_id), text)
+            print(CLEAR + text, flush=True)
+            shown = generic_id
+    except KeyboardInterrupt:
+        return
 
 if __name__ == '__main__':
-    run(dbpath='dbg_260123_filtered_with_probs.csv')
\ No newline at end of file
+    run(dbpath='dbg_260123_filtered_with_probs.columnar')
@@ -0,0 +1,113 @@
+from copy import deepcopy
+
+
+# Card parsing and canonicalization in pure Python, importable without numpy and numba
+# (lookup scripts, API front end). poker_eval re-exports everything.
+
+suits = ['s','d','h','c']
+values = ['2', '3', '4', '5', '6', '7', '8', '9', 't', 'j', 'q', 'k', 'a']
+
+
+class Card:
+    def __init__(self, idx):
+        self.idx = idx
+
+    @classmethod
+    def from_str(cls, s):
+        return Card(values.index(s[0]) * 4 + suits.index(s[1]))
+
+    @classmethod
+    def from_value_suit(cls, value, suit):
+        return Card(value*4+suit)
+
+    def __str__(self):
+        return values[self.idx // 4] + suits[self.idx % 4]
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __eq__(self, other):
+        return self.idx == other.idx
+
+    def value(self):
+        return self.idx//4
+
+    def suit(self):
+        return self.idx%4
+
+
+def str_to_cards(s: str):
+    return [Card.from_str(s[i:i+2]) for i in range(0, len(s), 2)]
+
+
+def str_to_cards_bis(s: str):
+    value_str = ""
+    cards = []
+    for c in s:
+        if c in suits:
+            value = int(value_str) - 2
+            suit = suits.index(c)
+            cards.append(Card.from_value_suit(value, suit))
+            value_str = ""
+        else:
+            value_str += c
+    return cards
+
+
+def cards_to_str(cards):
+    s = ""
+    for card in cards:
+        s += str(card)
+    return s
+
+def cards_to_str_bis(cards):
+    s = ""
+    for card in cards:
+        value_str = str(card.value()+2)
+        suit_str = suits[card.suit()]
+        s += value_str + suit_str
+    return s
+
+
+def get_generic_cards(cards, mapping):
+    cards = sorted(cards, key=lambda card : card.idx)
+    for i, card in enumerate(cards):
+        if card.suit() not in mapping:
+            mapping[card.suit()] = len(mapping)
+        cards[i] = Card.from_value_suit(card.value(), mapping[card.suit()])
+    return cards
+            
+
+def get_generic_hand(hand, group_sizes=None):
+    hand = deepcopy(hand)
+    mapping = {}
+    if group_sizes is None:
+        group_sizes = [2, len(hand)-2]
+    new_hand = []
+    for group_size in group_sizes:
+        if len(new_hand) + group_size > len(hand):
+            break
+        new_hand += get_generic_cards(hand[len(new_hand):len(new_hand)+group_size], mapping)
+    return new_hand
+
+
+def get_hand_id_table(hand):
+    id = 0
+    for card in hand:
+        id *= 52
+        id += card.idx
+    return id
+
+def get_hand_id(hand):
+    id = 0
+    for i in range(7):
+        id *= 53
+        if i < len(hand):
+            id += hand[i].idx+1
+    return id
+
+def get_generic_id_table(hand):
+    return get_hand_id_table(get_generic_hand(hand, group_sizes=None))
+
+def get_generic_id(hand):
+    return get_hand_id(get_generic_hand(hand, group_sizes=[2, 3, 1, 1]))
@@ -1,123 +1,138 @@
 
 from typing import Iterable, Tuple, List
-from random import sample
-from itertools import combinations
-from numba import njit
+from math import comb, factorial
+from functools import cached_property
+from random import getrandbits
+from numba import njit, prange
 import numpy as np
-from copy import deepcopy
+from hand_index import HandIndexer, NO_CARD
+from eval_cache import EvalCache
+from poker_cards import suits, values, Card, str_to_cards, str_to_cards_bis, cards_to_str, cards_to_str_bis
+from poker_cards import get_generic_cards, get_generic_hand, get_hand_id_table, get_hand_id, get_generic_id_table, get_generic_id
 import os
-import pickle
+import time
 
 
-suits = ['s','d','h','c']
-values = ['2', '3', '4', '5', '6', '7', '8', '9', 't', 'j', 'q', 'k', 'a']
+# Number of cards making each hand category, indexed by rank >> 12
+HAND_SIZES = np.array([-1, 1, 2, 4, 3, 5, 5, 5, 4, 5], dtype=np.int64)
 
+# The 1326 pockets (card1 < card2) and their id from the two cards
+POCKETS = np.array([(card1, card2) for card1 in range(52) for card2 in range(card1 + 1, 52)], dtype=np.int64)
+POCKET_IDS = np.full((52, 52), -1, dtype=np.int64)
+POCKET_IDS[POCKETS[:, 0], POCKETS[:, 1]] = np.arange(len(POCKETS))
+POCKET_IDS[POCKETS[:, 1], POCKETS[:, 0]] = np.arange(len(POCKETS))
 
-class Card:
-    def __init__(self, idx):
-        self.idx = idx
+# Monte Carlo samples are drawn by MC_STREAMS independent random streams (spread over the threads),
+# MC_BATCH samples per stream between two checks of the stopping criteria
+MC_STREAMS = 16
+MC_BATCH = 256
 
-    @classmethod
-    def from_str(cls, s):
-        return Card(values.index(s[0]) * 4 + suits.index(s[1]))
+# Columns of the optional hand potential metrics, besides the equity histogram
+POTENTIAL_METRICS = ('hs', 'ppot', 'npot', 'ehs')
 
-    @classmethod
-    def from_value_suit(cls, value, suit):
-        return Card(value*4+suit)
+# Position against the opponent, now (current board) and at the river, for the hand potential metrics
+AHEAD = 0
+TIED = 1
+BEHIND = 2
 
-    def __str__(self):
-        return values[self.idx // 4] + suits[self.idx % 4]
+# Multi-way odds are enumerated exactly when there are at most MULTIWAY_EXACT_BUDGET
+# (runout, set of opponent pockets) pairs, and estimated by Monte Carlo otherwise
+MULTIWAY_EXACT_BUDGET = 25_000_000
 
-    def __repr__(self):
-        return self.__str__()
+# The kernels are compiled with cache=True : the machine code is written next to the sources (__pycache__,
+# or NUMBA_CACHE_DIR when it is read-only) and loaded by the next processes instead of compiling again
 
-    def __eq__(self, other):
-        return self.idx == other.idx
 
-    def value(self):
-        return self.idx//4
+def cards_to_array(cards):
+    return np.array([card.idx for card in cards], dtype=np.int64)
 
-    def suit(self):
-        return self.idx%4
 
+def strs_to_array(strs, n_cards: int, bis_formatting=False):
+    # Parses card strings into an (N, n_cards) int array, missing cards are NO_CARD.
+    # Each distinct string is parsed once.
+    uniques, inverse = np.unique(np.asarray(strs, dtype=str), return_inverse=True)
+    parsed = np.full((len(uniques), n_cards), NO_CARD, dtype=np.int64)
+    for i, s in enumerate(uniques):
+        cards = str_to_cards_bis(s) if bis_formatting else str_to_cards(s)
+        parsed[i, :len(cards)] = [card.idx for card in cards]
+    return parsed[inverse.reshape(-1)]
 
-def str_to_cards(s: str):
-    return [Card.from_str(s[i:i+2]) for i in range(0, len(s), 2)]
 
+def strs_to_hands(pockets, tables, turns, rivers, bis_formatting=False):
+    # (N, 7) int array of hands from the card strings of each street, missing cards are NO_CARD
+    return np.concatenate([
+        strs_to_array(strs, n_cards, bis_formatting)
+        for strs, n_cards in ((pockets, 2), (tables, 3), (turns, 1), (rivers, 1))
+    ], axis=1)
 
-def str_to_cards_bis(s: str):
-    value_str = ""
-    cards = []
-    for c in s:
-        if c in suits:
-            value = int(value_str) - 2
-            suit = suits.index(c)
-            cards.append(Card.from_value_suit(value, suit))
-            value_str = ""
-        else:
-            value_str += c
-    return cards
 
+def array_to_strs(cards: np.ndarray, bis_formatting=False):
+    # Inverse of strs_to_array, returns an object array of strings
+    to_str = cards_to_str_bis if bis_formatting else cards_to_str
+    card_strs = np.array([to_str([Card(idx)]) for idx in range(52)] + [''], dtype=object)
+    cards = np.where(cards == NO_CARD, 52, cards)
+    strs = np.full(len(cards), '', dtype=object)
+    for i in range(cards.shape[1]):
+        strs = strs + card_strs[cards[:, i]]
+    return strs
 
-def cards_to_str(cards):
-    s = ""
-    for card in cards:
-        s += str(card)
-    return s
 
-def cards_to_str_bis(cards):
-    s = ""
-    for card in cards:
-        value_str = str(card.value()+2)
-        suit_str = suits[card.suit()]
-        s += value_str + suit_str
-    return s
-
-
-def get_generic_cards(cards, mapping):
-    cards = sorted(cards, key=lambda card : card.idx)
-    for i, card in enumerate(cards):
-        if card.suit() not in mapping:
-            mapping[card.suit()] = len(mapping)
-        cards[i] = Card.from_value_suit(card.value(), mapping[card.suit()])
-    return cards
-            
-
-def get_generic_hand(hand, group_sizes=None):
-    hand = deepcopy(hand)
-    mapping = {}
-    if group_sizes is None:
-        group_sizes = [2, len(hand)-2]
-    new_hand = []
-    for group_size in group_sizes:
-        if len(new_hand) + group_size > len(hand):
-            break
-        new_hand += get_generic_cards(hand[len(new_hand):len(new_hand)+group_size], mapping)
-    return new_hand
+def histograms_to_strs(histograms: np.ndarray):
+    # Rows of an (N, n_bins) histogram array as space separated strings, for the csv outputs
+    return np.array([' '.join(f'{x:.6g}' for x in histogram) for histogram in histograms], dtype=object)
+
+
+
+# Serial : these run in the build_db worker processes
+@njit(cache=True)
+def _generic_hands_batch(hands: np.ndarray, group_sizes: np.ndarray):
+    generic_hands = np.full(hands.shape, NO_CARD, dtype=np.int64)
+    for i in range(len(hands)):
+        hand = hands[i][hands[i] != NO_CARD]
+        mapping = np.full(4, -1, dtype=np.int64)
+        n_mapped = 0
+        start = 0
+        for group_size in group_sizes:
+            if start + group_size > len(hand):
+                break
+            group = np.sort(hand[start:start + group_size])
+            for j in range(group_size):
+                suit = group[j] % 4
+                if mapping[suit] < 0:
+                    mapping[suit] = n_mapped
+                    n_mapped += 1
+                generic_hands[i, start + j] = (group[j] // 4) * 4 + mapping[suit]
+            start += group_size
+    return generic_hands
+
+
+@njit(cache=True)
+def _hand_ids_batch(hands: np.ndarray):
+    ids = np.zeros(len(hands), dtype=np.int64)
+    for i in range(len(hands)):
+        for j in range(7):
+            ids[i] *= 53
+            if j < hands.shape[1] and hands[i, j] != NO_CARD:
+                ids[i] += hands[i, j] + 1
+    return ids
+
+
+def get_generic_hands_batch(hands: np.ndarray):
+    # Same as get_generic_hand(hand, group_sizes=[2, 3, 1, 1]) for an (N, 7) int array padded with NO_CARD
+    return _generic_hands_batch(np.asarray(hands, dtype=np.int64), np.array([2, 3, 1, 1], dtype=np.int64))
 
-def get_hand_id_table(hand):
-    id = 0
-    for card in hand:
-        id *= 52
-        id += card.idx
-    return id
 
-def get_hand_id(hand):
-    id = 0
-    for i in range(7):
-        id *= 53
-        if i < len(hand):
-            id += hand[i].idx+1
-    return id
+def get_hand_ids_batch(hands: np.ndarray):
+    # Same as get_hand_id for an (N, 7) int array padded with NO_CARD
+    return _hand_ids_batch(np.asarray(hands, dtype=np.int64))
 
-def get_generic_id_table(hand):
-    return get_hand_id_table(get_generic_hand(hand, group_sizes=None))
 
-def get_generic_id(hand):
-    return get_hand_id(get_generic_hand(hand, group_sizes=[2, 3, 1, 1]))
+def get_generic_ids_batch(hands: np.ndarray):
+    # Same as get_generic_id for an (N, 7) int array padded with NO_CARD
+    return get_hand_ids_batch(get_generic_hands_batch(hands))
 
 
-@njit
+@njit(cache=True)
 def _eval(rank_table: np.ndarray, ref: int, cards: Tuple[int], premature_rank: bool=False):
     p = ref
     for card in cards:
@@ -127,11 +142,616 @@ def _eval(rank_table: np.ndarray, ref: int, cards: Tuple[int], premature_rank: b
     return p
 
 
+@njit(cache=True)
+def _walk(rank_table: np.ndarray, ref: int, cards: np.ndarray):
+    p = ref
+    for card in cards:
+        p = rank_table[p + card + 1]
+    return p
+
+
+@njit(parallel=True, cache=True)
+def _eval_batch(rank_table: np.ndarray, cards: np.ndarray):
+    ranks = np.empty(len(cards), dtype=np.int32)
+    for i in prange(len(cards)):
+        p = 53
+        n_cards = 0
+        for card in cards[i]:
+            if card == NO_CARD:
+                continue
+            p = rank_table[p + card + 1]
+            n_cards += 1
+        if n_cards < 7:
+            p = rank_table[p]
+        ranks[i] = p
+    return ranks
+
+
+@njit(cache=True)
+def _checker(rank_table: np.ndarray, cards: np.ndarray):
+    # The contribution of a card is the largest rank loss when it is replaced by any unseen card.
+    # The rank of each replacement is a single lookup from the node of the other cards.
+    n_cards = len(cards)
+    true_rank = _walk(rank_table, 53, cards)
+    if n_cards < 7:
+        true_rank = rank_table[true_rank]
+    hand_size = HAND_SIZES[true_rank >> 12]
+    seen = np.zeros(52, dtype=np.bool_)
+    for card in cards:
+        seen[card] = True
+    contributions = np.zeros(n_cards, dtype=np.int64)
+    for idx in range(n_cards):
+        ref = 53
+        for j in range(n_cards):
+            if j != idx:
+                ref = rank_table[ref + cards[j] + 1]
+        for card in range(52):
+            if seen[card]:
+                continue
+            fake_rank = rank_table[ref + card + 1]
+            if n_cards < 7:
+                fake_rank = rank_table[fake_rank]
+            contributions[idx] = max(contributions[idx], true_rank - fake_rank)
+
+    # The hand is made of the hand_size cards with the largest (contribution, idx)
+    selected = np.zeros(n_cards, dtype=np.bool_)
+    board_contribution = 0
+    for _ in range(hand_size):
+        best = -1
+        for idx in range(n_cards):
+            if selected[idx]:
+                continue
+            if best < 0 or contributions[idx] >= contributions[best]:
+                best = idx
+        selected[best] = True
+        if best >= 2:
+            board_contribution += 1
+    return board_contribution / hand_size
+
+
+@njit(parallel=True, cache=True)
+def _checker_batch(rank_table: np.ndarray, cards: np.ndarray):
+    checkers = np.empty(len(cards), dtype=np.float64)
+    for i in prange(len(cards)):
+        row = cards[i]
+        hand = row[row != NO_CARD]
+        if len(hand) < 5:
+            checkers[i] = np.nan
+        else:
+            checkers[i] = _checker(rank_table, hand)
+    return checkers
+
+
+@njit(cache=True)
+def _combinations(cards: np.ndarray, k: int):
+    n = len(cards)
+    n_combinations = 1
+    for i in range(k):
+        n_combinations = n_combinations * (n - i) // (i + 1)
+    result = np.empty((n_combinations, k), dtype=cards.dtype)
+    indices = np.arange(k)
+    for row in range(n_combinations):
+        for i in range(k):
+            result[row, i] = cards[indices[i]]
+        i = k - 1
+        while i >= 0 and indices[i] == n - k + i:
+            i -= 1
+        if i < 0:
+            break
+        indices[i] += 1
+        for j in range(i + 1, k):
+            indices[j] = indices[j - 1] + 1
+    return result
+
+
+@njit(cache=True)
+def _unseen_cards(dead_cards: np.ndarray):
+    dead = np.zeros(52, dtype=np.bool_)
+    for card in dead_cards:
+        dead[card] = True
+    return np.nonzero(~dead)[0]
+
+
+def _rng_streams(seed: int, n_streams: int):
+    # splitmix64 of the seed, one state per stream
+    mask = (1 << 64) - 1
+    states = np.empty(n_streams, dtype=np.uint64)
+    for i in range(n_streams):
+        z = (seed + (i + 1) * 0x9E3779B97F4A7C15) & mask
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        states[i] = (z ^ (z >> 31)) or 1
+    return states
+
+
+@njit(cache=True)
+def _xorshift(state: np.uint64):
+    state ^= state >> np.uint64(12)
+    state ^= state << np.uint64(25)
+    state ^= state >> np.uint64(27)
+    return state
+
+
+@njit(cache=True)
+def _randint(state: np.uint64, n: int):
+    # uniform integer in [0, n) from a xorshift64* output
+    output = state * np.uint64(0x2545F4914F6CDD1D)
+    return np.int64(((output >> np.uint64(32)) * np.uint64(n)) >> np.uint64(32))
+
+
+@njit(parallel=True, cache=True)
+def _monte_carlo_round(rank_table: np.ndarray, pocket: np.ndarray, board: np.ndarray,
+                       rng_states: np.ndarray, decks: np.ndarray, counts: np.ndarray):
+    board_ref = _walk(rank_table, 53, board)
+    board_pocket_ref = _walk(rank_table, board_ref, pocket)
+    n_unseen = decks.shape[1]
+    n_drawn = 5 - len(board)
+    wins = np.zeros(len(rng_states), dtype=np.int64)
+    draws = np.zeros(len(rng_states), dtype=np.int64)
+    for s in prange(len(rng_states)):
+        state = rng_states[s]
+        deck = decks[s]
+        for _ in range(counts[s]):
+            # partial Fisher-Yates : the runout then the opponent cards end up in deck[:n_drawn+2]
+            for j in range(n_drawn + 2):
+                state = _xorshift(state)
+                m = j + _randint(state, n_unseen - j)
+                card = deck[j]
+                deck[j] = deck[m]
+                deck[m] = card
+            our_strength = _walk(rank_table, board_pocket_ref, deck[:n_drawn])
+            opp_strength = _walk(rank_table, board_ref, deck[:n_drawn + 2])
+            if our_strength > opp_strength:
+                wins[s] += 1
+            elif our_strength == opp_strength:
+                draws[s] += 1
+        rng_states[s] = state
+    return wins, draws
+
+
+def _std_error(wins: int, draws: int, total: int):
+    return _max_std_error(np.array([wins, draws]), total)
+
+
+def _max_std_error(counts: np.ndarray, total: int):
+    # Largest standard error of the probabilities counts / total
+    probs = np.asarray(counts) / total
+    return float(np.max(probs * (1 - probs))) ** 0.5 / total ** 0.5
+
+
+@njit(cache=True)
+def _count_runout(rank_table: np.ndarray, our_strength: int, full_board_ref: int, unseen: np.ndarray, runout: np.ndarray):
+    drawn = np.zeros(52, dtype=np.bool_)
+    for card in runout:
+        drawn[card] = True
+    wins = 0
+    draws = 0
+    total = 0
+    n_unseen = len(unseen)
+    for i in range(n_unseen - 1):
+        card1 = unseen[i]
+        if drawn[card1]:
+            continue
+        ref1 = rank_table[full_board_ref + card1 + 1]
+        for j in range(i + 1, n_unseen):
+            card2 = unseen[j]
+            if drawn[card2]:
+                continue
+            opp_strength = rank_table[ref1 + card2 + 1]
+            if our_strength > opp_strength:
+                wins += 1
+            elif our_strength == opp_strength:
+                draws += 1
+            total += 1
+    return wins, draws, total
+
+
+@njit(parallel=True, cache=True)
+def _exact_odds(rank_table: np.ndarray, board_ref: int, board_pocket_ref: int, unseen: np.ndarray, n_drawn: int):
+    # board_ref, board_pocket_ref : nodes of the board and of the board + pocket, unseen : the other cards
+    runouts = _combinations(unseen, n_drawn)
+    wins = np.zeros(len(runouts), dtype=np.int64)
+    draws = np.zeros(len(runouts), dtype=np.int64)
+    totals = np.zeros(len(runouts), dtype=np.int64)
+    for r in prange(len(runouts)):
+        runout = runouts[r]
+        our_strength = _walk(rank_table, board_pocket_ref, runout)
+        full_board_ref = _walk(rank_table, board_ref, runout)
+        wins[r], draws[r], totals[r] = _count_runout(rank_table, our_strength, full_board_ref, unseen, runout)
+    return wins.sum(), draws.sum(), totals.sum()
+
+
+@njit(parallel=True, cache=True)
+def _exact_odds_batch(rank_table: np.ndarray, pockets: np.ndarray, boards: np.ndarray):
+    # One hand per thread, runouts are enumerated sequentially
+    odds = np.empty((len(pockets), 2), dtype=np.float64)
+    for h in prange(len(pockets)):
+        pocket = pockets[h]
+        board = boards[h]
+        unseen = _unseen_cards(np.concatenate((pocket, board)))
+        board_ref = _walk(rank_table, 53, board)
+        board_pocket_ref = _walk(rank_table, board_ref, pocket)
+        runouts = _combinations(unseen, 5 - len(board))
+        wins = 0
+        draws = 0
+        total = 0
+        for r in range(len(runouts)):
+            runout = runouts[r]
+            our_strength = _walk(rank_table, board_pocket_ref, runout)
+            full_board_ref = _walk(rank_table, board_ref, runout)
+            runout_wins, runout_draws, runout_total = _count_runout(rank_table, our_strength, full_board_ref, unseen, runout)
+            wins += runout_wins
+            draws += runout_draws
+            total += runout_total
+        odds[h, 0] = wins / total
+        odds[h, 1] = draws / total
+    return odds
+
+
+@njit(cache=True)
+def _score_opponents(our_strength: int, opp_strengths: np.ndarray, counts: np.ndarray):
+    # counts : wins, then ties with 1..n opponents, then losses
+    n_tied = 0
+    for opp_strength in opp_strengths:
+        if opp_strength > our_strength:
+            counts[-1] += 1
+            return
+        if opp_strength == our_strength:
+            n_tied += 1
+    counts[n_tied] += 1
+
+
+@njit(cache=True)
+def _multiway_runout(rank_table: np.ndarray, our_strength: int, full_board_ref: int, live: np.ndarray,
+                     n_opponents: int, counts: np.ndarray):
+    # Strengths of all the live pockets are computed once from the complete board, then every set of
+    # n_opponents disjoint pockets is enumerated (depth first, pockets in increasing order)
+    n_live = len(live)
+    n_pockets = n_live * (n_live - 1) // 2
+    strengths = np.empty(n_pockets, dtype=np.int64)
+    masks = np.empty(n_pockets, dtype=np.int64)
+    k = 0
+    for i in range(n_live):
+        ref = rank_table[full_board_ref + live[i] + 1]
+        for j in range(i + 1, n_live):
+            strengths[k] = rank_table[ref + live[j] + 1]
+            masks[k] = (1 << live[i]) | (1 << live[j])
+            k += 1
+
+    chosen = np.full(n_opponents, -1, dtype=np.int64)
+    placed = np.zeros(n_opponents, dtype=np.bool_)
+    opp_strengths = np.empty(n_opponents, dtype=np.int64)
+    used = 0
+    depth = 0
+    while depth >= 0:
+        k = chosen[depth]
+        if placed[depth]:
+            used ^= masks[k]
+            placed[depth] = False
+        k += 1
+        while k < n_pockets and masks[k] & used:
+            k += 1
+        if k == n_pockets:
+            depth -= 1
+            continue
+        chosen[depth] = k
+        placed[depth] = True
+        used |= masks[k]
+        opp_strengths[depth] = strengths[k]
+        if depth == n_opponents - 1:
+            _score_opponents(our_strength, opp_strengths, counts)
+        else:
+            depth += 1
+            chosen[depth] = k
+            placed[depth] = False
+
+
+@njit(parallel=True, cache=True)
+def _multiway_exact(rank_table: np.ndarray, pocket: np.ndarray, board: np.ndarray, n_opponents: int):
+    unseen = _unseen_cards(np.concatenate((pocket, board)))
+    board_ref = _walk(rank_table, 53, board)
+    board_pocket_ref = _walk(rank_table, board_ref, pocket)
+    runouts = _combinations(unseen, 5 - len(board))
+    counts = np.zeros((len(runouts), n_opponents + 2), dtype=np.int64)
+    for r in prange(len(runouts)):
+        runout = runouts[r]
+        our_strength = _walk(rank_table, board_pocket_ref, runout)
+        full_board_ref = _walk(rank_table, board_ref, runout)
+        live = _unseen_cards(np.concatenate((pocket, board, runout)))
+        _multiway_runout(rank_table, our_strength, full_board_ref, live, n_opponents, counts[r])
+    return counts.sum(axis=0)
+
+
+@njit(parallel=True, cache=True)
+def _multiway_monte_carlo_round(rank_table: np.ndarray, pocket: np.ndarray, board: np.ndarray, n_opponents: int,
+                                rng_states: np.ndarray, decks: np.ndarray, counts: np.ndarray):
+    board_ref = _walk(rank_table, 53, board)
+    n_unseen = decks.shape[1]
+    n_drawn = 5 - len(board)
+    result = np.zeros((len(rng_states), n_opponents + 2), dtype=np.int64)
+    for s in prange(len(rng_states)):
+        state = rng_states[s]
+        deck = decks[s]
+        opp_strengths = np.empty(n_opponents, dtype=np.int64)
+        for _ in range(counts[s]):
+            # partial Fisher-Yates : the runout then the opponent cards end up in deck[:n_drawn+2*n_opponents]
+            for j in range(n_drawn + 2 * n_opponents):
+                state = _xorshift(state)
+                m = j + _randint(state, n_unseen - j)
+                card = deck[j]
+                deck[j] = deck[m]
+                deck[m] = card
+            full_board_ref = _walk(rank_table, board_ref, deck[:n_drawn])
+            our_strength = _walk(rank_table, full_board_ref, pocket)
+            for o in range(n_opponents):
+                opp_strengths[o] = _walk(rank_table, full_board_ref, deck[n_drawn + 2 * o:n_drawn + 2 * o + 2])
+            _score_opponents(our_strength, opp_strengths, result[s])
+        rng_states[s] = state
+    return result
+
+
+@njit(cache=True)
+def _current_ranks(rank_table: np.ndarray, board_ref: int, board_size: int, unseen: np.ndarray):
+    # (52, 52) rank of each opponent pocket of unseen cards on the current board (3 to 5 cards)
+    ranks = np.zeros((52, 52), dtype=np.int64)
+    for i in range(len(unseen)):
+        ref = rank_table[board_ref + unseen[i] + 1]
+        for j in range(i + 1, len(unseen)):
+            node = rank_table[ref + unseen[j] + 1]
+            ranks[unseen[i], unseen[j]] = node if board_size == 5 else rank_table[node]
+    return ranks
+
+
+@njit(cache=True)
+def _position(our_strength: int, opp_strength: int):
+    if our_strength > opp_strength:
+        return AHEAD
+    if our_strength == opp_strength:
+        return TIED
+    return BEHIND
+
+
+@njit(cache=True)
+def _metrics_runout(rank_table: np.ndarray, our_current: int, current_ranks: np.ndarray, our_final: int,
+                    full_board_ref: int, unseen: np.ndarray, runout: np.ndarray, potential: np.ndarray):
+    # Adds the (position now, position at the river) of every opponent pocket of the runout to potential (3, 3)
+    drawn = np.zeros(52, dtype=np.bool_)
+    for card in runout:
+        drawn[card] = True
+    for i in range(len(unseen)):
+        card1 = unseen[i]
+        if drawn[card1]:
+            continue
+        ref1 = rank_table[full_board_ref + card1 + 1]
+        for j in range(i + 1, len(unseen)):
+            card2 = unseen[j]
+            if drawn[card2]:
+                continue
+            now = _position(our_current, current_ranks[card1, card2])
+            potential[now, _position(our_final, rank_table[ref1 + card2 + 1])] += 1
+
+
+@njit(cache=True)
+def _equity_bin(potential: np.ndarray, n_bins: int):
+    # Histogram bin of the river equity of one runout
+    equity = (potential[:, AHEAD].sum() + potential[:, TIED].sum() / 2) / potential.sum()
+    return min(int(equity * n_bins), n_bins - 1)
+
+
+@njit(cache=True)
+def _hand_metrics(rank_table: np.ndarray, pocket: np.ndarray, board: np.ndarray, runouts: np.ndarray,
+                  n_bins: int, potential: np.ndarray, histogram: np.ndarray):
+    # One pass over the runouts and the opponent pockets : accumulates the potential matrix and the
+    # histogram of the river equity of each runout
+    unseen = _unseen_cards(np.concatenate((pocket, board)))
+    board_ref = _walk(rank_table, 53, board)
+    board_pocket_ref = _walk(rank_table, board_ref, pocket)
+    current_ranks = _current_ranks(rank_table, board_ref, len(board), unseen)
+    our_current = board_pocket_ref if len(board) == 5 else rank_table[board_pocket_ref]
+    runout_potential = np.empty((3, 3), dtype=np.int64)
+    for r in range(len(runouts)):
+        runout = runouts[r]
+        runout_potential[:] = 0
+        _metrics_runout(rank_table, our_current, current_ranks, _walk(rank_table, board_pocket_ref, runout),
+                        _walk(rank_table, board_ref, runout), unseen, runout, runout_potential)
+        potential += runout_potential
+        histogram[_equity_bin(runout_potential, n_bins)] += 1
+
+
+@njit(parallel=True, cache=True)
+def _hand_metrics_batch(rank_table: np.ndarray, pockets: np.ndarray, boards: np.ndarray, n_bins: int):
+    # Exact metrics of each hand, one hand per thread
+    potentials = np.zeros((len(pockets), 3, 3), dtype=np.int64)
+    histograms = np.zeros((len(pockets), n_bins), dtype=np.int64)
+    for h in prange(len(pockets)):
+        unseen = _unseen_cards(np.concatenate((pockets[h], boards[h])))
+        runouts = _combinations(unseen, 5 - boards.shape[1])
+        _hand_metrics(rank_table, pockets[h], boards[h], runouts, n_bins, potentials[h], histograms[h])
+    return potentials, histograms
+
+
+@njit(parallel=True, cache=True)
+def _hand_metrics_monte_carlo(rank_table: np.ndarray, pocket: np.ndarray, board: np.ndarray, n_bins: int,
+                              rng_states: np.ndarray, decks: np.ndarray, counts: np.ndarray):
+    # Same as _hand_metrics on random runouts, each of them against all the opponent pockets
+    n_drawn = 5 - len(board)
+    potentials = np.zeros((len(rng_states), 3, 3), dtype=np.int64)
+    histograms = np.zeros((len(rng_states), n_bins), dtype=np.int64)
+    for s in prange(len(rng_states)):
+        state = rng_states[s]
+        deck = decks[s]
+        runouts = np.empty((counts[s], n_drawn), dtype=np.int64)
+        for i in range(counts[s]):
+            for j in range(n_drawn):
+                state = _xorshift(state)
+                m = j + _randint(state, len(deck) - j)
+                card = deck[j]
+                deck[j] = deck[m]
+                deck[m] = card
+            runouts[i] = deck[:n_drawn]
+        _hand_metrics(rank_table, pocket, board, runouts, n_bins, potentials[s], histograms[s])
+        rng_states[s] = state
+    return potentials.sum(axis=0), histograms.sum(axis=0)
+
+
+def _potential_metrics(potentials: np.ndarray, histograms: np.ndarray):
+    # Metrics from potential matrices (..., 3, 3) and equity histograms (..., n_bins) :
+    # prob_win and prob_draw at the river, hand strength now, positive and negative potential and effective hand strength
+    potentials = potentials.astype(np.float64)
+    total = potentials.sum(axis=(-2, -1))
+    now = potentials.sum(axis=-1)
+    hs = (now[..., AHEAD] + now[..., TIED] / 2) / total
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ppot = (potentials[..., BEHIND, AHEAD] + potentials[..., BEHIND, TIED] / 2 + potentials[..., TIED, AHEAD] / 2) \
+            / (now[..., BEHIND] + now[..., TIED] / 2)
+        npot = (potentials[..., AHEAD, BEHIND] + potentials[..., TIED, BEHIND] / 2 + potentials[..., AHEAD, TIED] / 2) \
+            / (now[..., AHEAD] + now[..., TIED] / 2)
+    ppot = np.nan_to_num(ppot)
+    npot = np.nan_to_num(npot)
+    return {
+        'proba_win': potentials[..., :, AHEAD].sum(axis=-1) / total,
+        'proba_draw': potentials[..., :, TIED].sum(axis=-1) / total,
+        'hs': hs,
+        'ppot': ppot,
+        'npot': npot,
+        'ehs': hs * (1 - npot) + (1 - hs) * ppot,
+        'equity_histogram': histograms / histograms.sum(axis=-1, keepdims=True),
+    }
+
+
+def precomputed_tables_exist():
+    # Whether precalc_flop_turn.py has been run, i.e. Evaluator(precomputed=True) can be used
+    return all(os.path.exists(os.path.join(os.path.dirname(__file__), name)) for name in ('flop_table.npy', 'turn_table.npy'))
+
+
+def load_rank_table(filename: str=None):
+    # Read-only memory map of the table built by build_rank_table.py : all the processes share the same pages
+    if filename is None:
+        filename = os.path.join(os.path.dirname(__file__), "rank_table.bin")
+    return np.memmap(filename, dtype=np.int32, mode='r')
+
+
+@njit(cache=True)
+def _full_board_counts(rank_table: np.ndarray, board: np.ndarray, weight: int, opp_weights: np.ndarray,
+                       wins: np.ndarray, draws: np.ndarray, totals: np.ndarray):
+    # Adds the wins, draws and matchups of every live pocket against every other live pocket on a complete
+    # board, opponents being weighted by opp_weights (1326) and the board by weight.
+    # Strengths are computed once per pocket and sorted, then the opponents beaten by a pocket (a, b) are
+    # the weaker pockets minus the weaker pockets containing a or b (card removal), and the same for draws.
+    live = _unseen_cards(board)
+    n_live = len(live)
+    board_ref = _walk(rank_table, 53, board)
+    n_pockets = n_live * (n_live - 1) // 2
+    strengths = np.empty(n_pockets, dtype=np.int64)
+    pocket_ids = np.empty(n_pockets, dtype=np.int64)
+    pocket_weights = np.empty(n_pockets, dtype=np.float64)
+    card_totals = np.zeros(52, dtype=np.float64)
+    total = 0.
+    k = 0
+    for i in range(n_live):
+        ref = rank_table[board_ref + live[i] + 1]
+        for j in range(i + 1, n_live):
+            strengths[k] = rank_table[ref + live[j] + 1]
+            pocket_ids[k] = POCKET_IDS[live[i], live[j]]
+            pocket_weights[k] = opp_weights[pocket_ids[k]]
+            card_totals[live[i]] += pocket_weights[k]
+            card_totals[live[j]] += pocket_weights[k]
+            total += pocket_weights[k]
+            k += 1
+
+    # groups of equal strengths in increasing order, card_below / card_group : weight of the pockets
+    # containing the card below / in the current group
+    order = np.argsort(strengths)
+    card_below = np.zeros(52, dtype=np.float64)
+    card_group = np.zeros(52, dtype=np.float64)
+    below = 0.
+    start = 0
+    while start < n_pockets:
+        group = 0.
+        end = start
+        while end < n_pockets and strengths[order[end]] == strengths[order[start]]:
+            pocket_id = pocket_ids[order[end]]
+            group += pocket_weights[order[end]]
+            card_group[POCKETS[pocket_id, 0]] += pocket_weights[order[end]]
+            card_group[POCKETS[pocket_id, 1]] += pocket_weights[order[end]]
+            end += 1
+        for i in range(start, end):
+            k = order[i]
+            card1 = POCKETS[pocket_ids[k], 0]
+            card2 = POCKETS[pocket_ids[k], 1]
+            # the pocket itself is removed twice, once per card
+            wins[pocket_ids[k]] += weight * (below - card_below[card1] - card_below[card2])
+            draws[pocket_ids[k]] += weight * (group - card_group[card1] - card_group[card2] + pocket_weights[k])
+            totals[pocket_ids[k]] += weight * (total - card_totals[card1] - card_totals[card2] + pocket_weights[k])
+        for i in range(start, end):
+            k = order[i]
+            for card in POCKETS[pocket_ids[k]]:
+                card_below[card] += card_group[card]
+                card_group[card] = 0.
+        below += group
+        start = end
+
+
+@njit(parallel=True, cache=True)
+def _boards_pocket_counts(rank_table: np.ndarray, boards: np.ndarray, weights: np.ndarray, opp_weights: np.ndarray):
+    # Sums _full_board_counts over complete boards, returns the wins, draws and totals of the 1326 pockets
+    n_chunks = min(len(boards), 256)
+    wins = np.zeros((n_chunks, len(POCKETS)), dtype=np.float64)
+    draws = np.zeros((n_chunks, len(POCKETS)), dtype=np.float64)
+    totals = np.zeros((n_chunks, len(POCKETS)), dtype=np.float64)
+    for chunk in prange(n_chunks):
+        for b in range(chunk, len(boards), n_chunks):
+            _full_board_counts(rank_table, boards[b], weights[b], opp_weights, wins[chunk], draws[chunk], totals[chunk])
+    return wins.sum(axis=0), draws.sum(axis=0), totals.sum(axis=0)
+
+
+@njit(parallel=True, cache=True)
+def _equity_matrix(rank_table: np.ndarray, board: np.ndarray):
+    # Equity of every pocket against every other pocket over all the runouts of the board, nan when they share a card
+    runouts = _combinations(_unseen_cards(board), 5 - len(board))
+    board_ref = _walk(rank_table, 53, board)
+    strengths = np.full((len(POCKETS), len(runouts)), -1, dtype=np.int32)
+    for r in prange(len(runouts)):
+        full_board_ref = _walk(rank_table, board_ref, runouts[r])
+        dead = np.zeros(52, dtype=np.bool_)
+        for card in board:
+            dead[card] = True
+        for card in runouts[r]:
+            dead[card] = True
+        for p in range(len(POCKETS)):
+            if not dead[POCKETS[p, 0]] and not dead[POCKETS[p, 1]]:
+                strengths[p, r] = rank_table[rank_table[full_board_ref + POCKETS[p, 0] + 1] + POCKETS[p, 1] + 1]
+
+    equities = np.full((len(POCKETS), len(POCKETS)), np.nan)
+    for i in prange(len(POCKETS)):
+        for j in range(i + 1, len(POCKETS)):
+            if POCKETS[j, 0] == POCKETS[i, 0] or POCKETS[j, 0] == POCKETS[i, 1] \
+                    or POCKETS[j, 1] == POCKETS[i, 0] or POCKETS[j, 1] == POCKETS[i, 1]:
+                continue
+            wins = 0
+            draws = 0
+            total = 0
+            for r in range(len(runouts)):
+                strength_i = strengths[i, r]
+                strength_j = strengths[j, r]
+                if strength_i < 0 or strength_j < 0:
+                    continue
+                total += 1
+                if strength_i > strength_j:
+                    wins += 1
+                elif strength_i == strength_j:
+                    draws += 1
+            if total > 0:
+                equities[i, j] = (wins + draws / 2) / total
+                equities[j, i] = 1 - equities[i, j]
+    return equities
+
+
 class Evaluator:
-    def __init__(self, precomputed=False):
-        rank_table_filename = os.path.join(os.path.dirname(__file__), "rank_table.bin")
-        rank_table_file = open(rank_table_filename, "r")
-        self.rank_table = np.fromfile(rank_table_file, dtype=np.int32)
+    def __init__(self, precomputed=False, cache: EvalCache=None):
+        # cache : optional EvalCache checked by check_odds and get_checker before any computation
+        # The tables are loaded on first use (see the properties below)
+        self.cache = cache
         self.rank_to_str_dict = {
             1: 'HIGH_CARD',
             2: 'ONE_PAIR',
@@ -143,118 +763,292 @@ class Evaluator:
             8: 'FOUR_OF_A_KIND',
             9: 'STRAIGHT_FLUSH'  
         }
+        self.rank_names = np.array([''] + [self.rank_to_str_dict[i] for i in range(1, 10)], dtype=object)
         self.deck = [Card(i) for i in range(52)]
-        preflop_table_filename = os.path.join(os.path.dirname(__file__), "preflop_table.npy")
-        self.preflop_table = np.load(preflop_table_filename)
-
         self.precomputed = precomputed
-        if precomputed:
-            flop_table_filename = os.path.join(os.path.dirname(__file__), "flop_table.pkl")
-            turn_table_filename = os.path.join(os.path.dirname(__file__), "turn_table.pkl")
-            self.flop_table = pickle.load(open(flop_table_filename, 'rb'))
-            self.turn_table = pickle.load(open(turn_table_filename, 'rb'))
+
+    @cached_property
+    def rank_table(self):
+        return load_rank_table()
+
+    @cached_property
+    def preflop_table(self):
+        # Odds of the 169 preflop classes built by precalc_preflop.py, indexed by preflop_indexer
+        return np.load(os.path.join(os.path.dirname(__file__), "preflop_table.npy"))
+
+    @cached_property
+    def preflop_indexer(self):
+        return HandIndexer([2])
+
+    # Tables built by precalc_flop_turn.py, used with precomputed=True,
+    # memory-mapped so that all processes share them
+    @cached_property
+    def flop_table(self):
+        return np.load(os.path.join(os.path.dirname(__file__), "flop_table.npy"), mmap_mode='r')
+
+    @cached_property
+    def turn_table(self):
+        return np.load(os.path.join(os.path.dirname(__file__), "turn_table.npy"), mmap_mode='r')
+
+    @cached_property
+    def flop_indexer(self):
+        return HandIndexer([2, 3])
+
+    @cached_property
+    def turn_indexer(self):
+        return HandIndexer([2, 4])
 
     
     def eval(self, cards: Iterable[int]):
         cards = tuple(card.idx for card in cards)
         return _eval(self.rank_table, 53, cards, premature_rank=(len(cards) < 7))
 
-    def _get_contribution(self, cards, idx):
-        true_rank = self.eval(cards)
-        fake_cards = deepcopy(cards)
-        max_contrib = 0
-        for card in self.deck:
-            if card in cards:
-                continue
-            fake_cards[idx] = card
-            fake_rank = self.eval(fake_cards)
-            contribution = true_rank - fake_rank
-            if contribution > max_contrib:
-                max_contrib = contribution
-        return max_contrib
+    def eval_batch(self, cards: np.ndarray):
+        # cards : int array of shape (N, 5..7), shorter hands are padded with NO_CARD
+        # Hands with less than 5 cards get the rank 0
+        cards = np.asarray(cards)
+        if cards.ndim != 2 or not 5 <= cards.shape[1] <= 7:
+            raise RuntimeError("invalid hand size")
+        return _eval_batch(self.rank_table, cards)
+
+    def _cached(self, kind: tuple, hand: List[Card], compute):
+        # compute() through the cache, keyed by kind and the generic id of the hand
+        if self.cache is None:
+            return compute()
+        key = kind + (get_generic_id(hand),)
+        value = self.cache.get(key)
+        if value is None:
+            value = compute()
+            self.cache.put(key, value)
+        return value
 
     def get_checker(self, pocket: List[Card], board: List[Card], subrank=False):
-        cards = pocket + board
-        hand_size = [-1, 1, 2, 4, 3, 5, 5, 5, 4, 5][self.eval(cards) >> 12]
-        contributions = [self._get_contribution(cards, idx) for idx in range(len(cards))]
-        sorted_cards = sorted(list(range(len(cards))), reverse=True, key=lambda idx: (contributions[idx], idx))
-        hand_cards = sorted_cards[:hand_size]
-        board_contribution = sum(1 for card in hand_cards if card >= 2)
-        return board_contribution / hand_size
+        return self._cached(('checker',), pocket + board, lambda: _checker(self.rank_table, cards_to_array(pocket + board)))
+
+    def get_checker_batch(self, cards: np.ndarray):
+        # cards : int array (N, 5..7), pocket first, padded with NO_CARD. Rows with less than 5 cards give nan
+        cards = np.asarray(cards)
+        if cards.ndim != 2 or not 5 <= cards.shape[1] <= 7:
+            raise RuntimeError("invalid hand size")
+        return _checker_batch(self.rank_table, cards)
 
     def rank_to_str(self, rank: int):
         return self.rank_to_str_dict[rank >> 12]
 
+    def ranks_to_str(self, ranks: np.ndarray):
+        # Vectorized rank_to_str, rank 0 (no hand) gives an empty string
+        return self.rank_names[np.asarray(ranks) >> 12]
+
     def check_odds_exact(self, pocket: List[Card], board: List[Card]):
-        unseen_deck = tuple(card.idx for card in self.deck if card not in (pocket + board))
-        pocket = tuple(card.idx for card in pocket)
-        board = tuple(card.idx for card in board)
-        
-        if len(board) > 0:
-            board_ref = _eval(self.rank_table, 53, board)
-        else:
-            board_ref = 53
+        pocket = cards_to_array(pocket)
+        board = cards_to_array(board)
+        board_ref = _walk(self.rank_table, 53, board)
+        wins, draws, total = _exact_odds(self.rank_table, board_ref, _walk(self.rank_table, board_ref, pocket),
+                                         _unseen_cards(np.concatenate((pocket, board))), 5 - len(board))
+        return wins/total, draws/total
 
-        board_pocket_ref = _eval(self.rank_table, board_ref, pocket)
+    def check_odds_exact_batch(self, pockets: np.ndarray, boards: np.ndarray):
+        # pockets : int array (N, 2), boards : int array (N, 0..5), returns (N, 2) array of prob_win, prob_draw
+        return _exact_odds_batch(self.rank_table, np.asarray(pockets, dtype=np.int64), np.asarray(boards, dtype=np.int64))
 
+    def check_odds_monte_carlo(self, pocket: List[Card], board: List[Card], n_samples: int=1_000_000,
+                               target_std_error: float=None, time_budget: float=None, seed: int=None):
+        # Draws up to n_samples, stopping early once the standard error of both probabilities is below
+        # target_std_error or once time_budget seconds have elapsed.
+        # Returns prob_win, prob_draw, the number of samples used and the standard error.
+        pocket = cards_to_array(pocket)
+        board = cards_to_array(board)
+        if seed is None:
+            seed = getrandbits(64)
+        rng_states = _rng_streams(seed, MC_STREAMS)
+        decks = np.tile(_unseen_cards(np.concatenate((pocket, board))), (MC_STREAMS, 1))
+        start = time.perf_counter()
         wins = 0
         draws = 0
         total = 0
-        for unseen_board in combinations(unseen_deck, 5-len(board)):
-            if len(unseen_board) == 0:
-                our_strength = board_pocket_ref
-                full_board_ref = board_ref
-            else:
-                our_strength = _eval(self.rank_table, board_pocket_ref, unseen_board)
-                full_board_ref = _eval(self.rank_table, board_ref, unseen_board)
-
-            undrawn_deck = tuple(card for card in unseen_deck if card not in unseen_board)
-            for opp_cards in combinations(undrawn_deck, 2):
-                opp_strength = _eval(self.rank_table, full_board_ref, opp_cards)
-                if our_strength > opp_strength:
-                    wins += 1
-                elif our_strength == opp_strength:
-                    draws += 1
-                total += 1
-        return wins/total, draws/total
+        std_error = 1.
+        while total < n_samples:
+            n_round = min(MC_STREAMS * MC_BATCH, n_samples - total)
+            counts = np.full(MC_STREAMS, n_round // MC_STREAMS, dtype=np.int64)
+            counts[:n_round % MC_STREAMS] += 1
+            round_wins, round_draws = _monte_carlo_round(self.rank_table, pocket, board, rng_states, decks, counts)
+            wins += int(round_wins.sum())
+            draws += int(round_draws.sum())
+            total += n_round
+            std_error = _std_error(wins, draws, total)
+            if target_std_error is not None and std_error <= target_std_error:
+                break
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                break
+        return wins/total, draws/total, total, std_error
 
-    def check_odds_monte_carlo(self, pocket: List[Card], board: List[Card], n_samples: int):
-        unseen_deck = tuple(card.idx for card in self.deck if card not in pocket + board)
-        pocket = tuple(card.idx for card in pocket)
-        board = tuple(card.idx for card in board)
-        wins = 0
-        draws = 0
-        total = 0
-        for _ in range(n_samples):
-            board_opp_cards = tuple(sample(unseen_deck, 5-len(board)+2))
-            opp_cards = board_opp_cards[:2]
-            unseen_board = board_opp_cards[2:]
-            full_board = board + unseen_board
-            our_strength = _eval(self.rank_table, 53, full_board + pocket)
-            opp_strength = _eval(self.rank_table, 53, full_board + opp_cards)
-            if our_strength > opp_strength:
-                wins += 1
-            elif our_strength == opp_strength:
-                draws += 1
-            total += 1
-        return wins/total, draws/total
+    def check_odds_multiway(self, pocket: List[Card], board: List[Card], n_opponents: int, n_samples: int=1_000_000,
+                            target_std_error: float=None, time_budget: float=None, seed: int=None):
+        # Odds against n_opponents random pockets : returns prob_win, prob_ties and prob_loss, where prob_ties[k-1]
+        # is the probability of splitting the pot with k opponents (the pot equity is prob_win + sum(prob_ties[k-1] / (k+1))).
+        # Enumerated exactly when affordable, otherwise sampled like check_odds_monte_carlo.
+        pocket = cards_to_array(pocket)
+        board = cards_to_array(board)
+        if n_opponents < 1 or len(board) not in (0, 3, 4, 5):
+            raise RuntimeError("invalid number of opponents or board size")
+        n_unseen = 50 - len(board)
+        n_live = n_unseen - (5 - len(board))
+        if 2 * n_opponents > n_live:
+            raise RuntimeError("not enough cards for the opponents")
+        n_opponent_sets = 1
+        for o in range(n_opponents):
+            n_opponent_sets *= comb(n_live - 2 * o, 2)
+        n_opponent_sets //= factorial(n_opponents)
+        if 0 < comb(n_unseen, 5 - len(board)) * n_opponent_sets <= MULTIWAY_EXACT_BUDGET:
+            counts = _multiway_exact(self.rank_table, pocket, board, n_opponents)
+        else:
+            if seed is None:
+                seed = getrandbits(64)
+            rng_states = _rng_streams(seed, MC_STREAMS)
+            decks = np.tile(_unseen_cards(np.concatenate((pocket, board))), (MC_STREAMS, 1))
+            start = time.perf_counter()
+            counts = np.zeros(n_opponents + 2, dtype=np.int64)
+            while counts.sum() < n_samples:
+                n_round = min(MC_STREAMS * MC_BATCH, n_samples - counts.sum())
+                stream_counts = np.full(MC_STREAMS, n_round // MC_STREAMS, dtype=np.int64)
+                stream_counts[:n_round % MC_STREAMS] += 1
+                counts += _multiway_monte_carlo_round(self.rank_table, pocket, board, n_opponents,
+                                                      rng_states, decks, stream_counts).sum(axis=0)
+                if target_std_error is not None and _max_std_error(counts, counts.sum()) <= target_std_error:
+                    break
+                if time_budget is not None and time.perf_counter() - start >= time_budget:
+                    break
+        probs = counts / counts.sum()
+        return float(probs[0]), probs[1:-1], float(probs[-1])
+
+    def hand_metrics(self, pocket: List[Card], board: List[Card], n_bins: int=10, n_samples: int=None, seed: int=None):
+        # From a single pass over the runouts and the opponent pockets : proba_win, proba_draw, the hand strength
+        # on the current board (hs), the positive / negative potential (ppot, npot), the effective hand strength
+        # (ehs) and the histogram of the river equity over the runouts (n_bins bins between 0 and 1).
+        # All the runouts are enumerated, or n_samples random runouts are drawn if given. The board has 3 to 5 cards
+        pocket = cards_to_array(pocket)
+        board = cards_to_array(board)
+        if len(board) not in (3, 4, 5):
+            raise RuntimeError("invalid board size")
+        if n_samples is None:
+            potential = np.zeros((3, 3), dtype=np.int64)
+            histogram = np.zeros(n_bins, dtype=np.int64)
+            runouts = _combinations(_unseen_cards(np.concatenate((pocket, board))), 5 - len(board))
+            _hand_metrics(self.rank_table, pocket, board, runouts, n_bins, potential, histogram)
+        else:
+            if seed is None:
+                seed = getrandbits(64)
+            counts = np.full(MC_STREAMS, n_samples // MC_STREAMS, dtype=np.int64)
+            counts[:n_samples % MC_STREAMS] += 1
+            decks = np.tile(_unseen_cards(np.concatenate((pocket, board))), (MC_STREAMS, 1))
+            potential, histogram = _hand_metrics_monte_carlo(self.rank_table, pocket, board, n_bins,
+                                                             _rng_streams(seed, MC_STREAMS), decks, counts)
+        metrics = _potential_metrics(potential, histogram)
+        return {key: value if key == 'equity_histogram' else float(value) for key, value in metrics.items()}
+
+    def hand_metrics_batch(self, pockets: np.ndarray, boards: np.ndarray, n_bins: int=10):
+        # Exact hand_metrics of pockets (N, 2) on boards (N, 3..5), as a dict of arrays
+        pockets = np.asarray(pockets, dtype=np.int64)
+        boards = np.asarray(boards, dtype=np.int64)
+        if boards.shape[1] not in (3, 4, 5):
+            raise RuntimeError("invalid board size")
+        return _potential_metrics(*_hand_metrics_batch(self.rank_table, pockets, boards, n_bins))
 
     def check_odds_flop(self, pocket: List[Card], board: List[Card]):
         if self.precomputed:
-            return self.flop_table[get_generic_id_table(pocket + board)]
+            prob_win, prob_draw = self.flop_table[self.flop_indexer.index(cards_to_array(pocket + board))]
+            return float(prob_win), float(prob_draw)
         else:
-            return self.check_odds_monte_carlo(pocket, board, 20000)
+            return self.check_odds_exact(pocket, board)
 
     def check_odds_turn(self, pocket: List[Card], board: List[Card]):
         if self.precomputed:
-            return self.turn_table[get_generic_id_table(pocket + board)]
+            prob_win, prob_draw = self.turn_table[self.turn_indexer.index(cards_to_array(pocket + board))]
+            return float(prob_win), float(prob_draw)
         else:
             return self.check_odds_exact(pocket, board)
 
     def check_odds_preflop(self, pocket: List[Card]):
-        return tuple(self.preflop_table[pocket[0].idx, pocket[1].idx])
+        return tuple(self.preflop_table[self.preflop_indexer.index(cards_to_array(pocket))])
+
+    def pocket_counts(self, boards: np.ndarray, weights: np.ndarray=None, opp_weights: np.ndarray=None):
+        # Wins, draws and number of matchups of each of the 1326 pockets (see POCKETS) against one
+        # opponent, summed over the complete boards (M, 5), each board counting weights[m] times.
+        # The opponent pockets are weighted by opp_weights (1326), uniformly by default
+        boards = np.asarray(boards, dtype=np.int64)
+        if boards.ndim != 2 or boards.shape[1] != 5:
+            raise RuntimeError("invalid board size")
+        if weights is None:
+            weights = np.ones(len(boards), dtype=np.int64)
+        if opp_weights is None:
+            opp_weights = np.ones(len(POCKETS), dtype=np.float64)
+        return _boards_pocket_counts(self.rank_table, boards, np.asarray(weights, dtype=np.int64),
+                                     np.asarray(opp_weights, dtype=np.float64))
+
+    def range_counts(self, villain, board: List[Card]):
+        # pocket_counts of every pocket against the villain range (a Range or 1326 weights), summed over all
+        # the runouts of the board : each runout is evaluated once for all the combos of both ranges
+        board = cards_to_array(board)
+        if len(board) not in (0, 3, 4, 5):
+            raise RuntimeError("invalid board size")
+        runouts = _combinations(_unseen_cards(board), 5 - len(board))
+        boards = np.concatenate((np.tile(board, (len(runouts), 1)), runouts), axis=1)
+        return self.pocket_counts(boards, opp_weights=getattr(villain, 'weights', villain))
+
+    def range_equity(self, hero, villain, board: List[Card]):
+        # prob_win, prob_draw of the hero range against the villain range, the matchups being weighted
+        # by the product of the weights of both combos
+        wins, draws, totals = self.range_counts(villain, board)
+        hero_weights = np.asarray(getattr(hero, 'weights', hero), dtype=np.float64)
+        total = hero_weights @ totals
+        if total == 0:
+            raise RuntimeError("no compatible combos")
+        return float(hero_weights @ wins / total), float(hero_weights @ draws / total)
 
-    def check_odds(self, pocket: List[Card], board: List[Card]):
+    def hand_vs_range(self, pocket: List[Card], villain, board: List[Card]):
+        hero_weights = np.zeros(len(POCKETS))
+        hero_weights[POCKET_IDS[pocket[0].idx, pocket[1].idx]] = 1
+        return self.range_equity(hero_weights, villain, board)
+
+    def board_equities(self, board: List[Card]):
+        # (1326, 2) prob_win, prob_draw of every pocket (see POCKETS) against one random opponent on the board,
+        # nan for the pockets holding a board card. All the pockets are ranked once per runout, so this is
+        # much cheaper than check_odds_exact for each pocket when many pockets share the board
+        wins, draws, totals = self.range_counts(np.ones(len(POCKETS)), board)
+        with np.errstate(invalid='ignore'):
+            return np.stack((wins / totals, draws / totals), axis=1)
+
+    def equity_matrix(self, board: List[Card]):
+        # (1326, 1326) all-in equity of each pocket against each other pocket (see POCKETS), nan when they share
+        # a card or a card of the board. The board must have at least 3 cards
+        board = cards_to_array(board)
+        if len(board) not in (3, 4, 5):
+            raise RuntimeError("invalid board size")
+        return _equity_matrix(self.rank_table, board)
+
+    def check_odds_batch(self, pockets: np.ndarray, boards: np.ndarray):
+        # Same as check_odds for int arrays pockets (N, 2) and boards (N, board size), returns an (N, 2) array
+        pockets = np.asarray(pockets, dtype=np.int64)
+        boards = np.asarray(boards, dtype=np.int64)
+        board_size = boards.shape[1]
+        if board_size == 0:
+            return self.preflop_table[self.preflop_indexer.index_batch(pockets)]
+        if self.precomputed and board_size == 3:
+            return np.asarray(self.flop_table[self.flop_indexer.index_batch(np.concatenate((pockets, boards), axis=1))], dtype=np.float64)
+        if self.precomputed and board_size == 4:
+            return np.asarray(self.turn_table[self.turn_indexer.index_batch(np.concatenate((pockets, boards), axis=1))], dtype=np.float64)
+        if board_size in (3, 4, 5):
+            return self.check_odds_exact_batch(pockets, boards)
+        raise RuntimeError("invalid board size")
+
+    def check_odds(self, pocket: List[Card], board: List[Card], n_opponents: int=1):
+        # Heads-up : prob_win, prob_draw. Against several opponents : prob_win, prob_ties, prob_loss (see check_odds_multiway)
+        return self._cached(('odds', n_opponents, self.precomputed), pocket + board,
+                            lambda: self._check_odds(pocket, board, n_opponents))
+
+    def _check_odds(self, pocket: List[Card], board: List[Card], n_opponents: int):
+        if n_opponents != 1:
+            return self.check_odds_multiway(pocket, board, n_opponents)
         if len(board) == 0:
             return self.check_odds_preflop(pocket)
         if len(board) == 3:
@@ -265,30 +1059,85 @@ class Evaluator:
             return self.check_odds_exact(pocket, board)
         raise RuntimeError("invalid board size")
 
-    def full_evaluation(self, pocket_str: str, board_str: str, bis_formatting=False):
-        if not bis_formatting:
-            pocket = str_to_cards(pocket_str)
-            board = str_to_cards(board_str)
-        else:
-            pocket = str_to_cards_bis(pocket_str)
-            board = str_to_cards_bis(board_str)
-        if board == []:
-            prob_win, prob_draw = self.check_odds(pocket, [])
-            return None, None, prob_win, prob_draw
-        rank = self.eval(pocket + board)
-        checker = self.get_checker(pocket, board)
-        prob_win, prob_draw = self.check_odds(pocket, board)
-        return rank, checker, prob_win, prob_draw
-
-
-def run_preflop(evaluator, pocket):
-    _, _, prob_win, prob_draw = evaluator.full_evaluation(pocket, "")
+    def full_evaluation(self, pocket_str: str, board_str: str, bis_formatting=False, n_opponents: int=1):
+        # rank, checker, then the odds returned by check_odds
+        session = HandSession(self, pocket_str, bis_formatting)
+        session.deal(board_str)
+        return session.evaluate(n_opponents)
+
+
+class HandSession:
+    # One hand fed street by street (pocket, then flop, turn and river). The rank_table nodes of the board
+    # and of the board + pocket and the dead cards are kept between streets, so a new street only walks
+    # its own cards before computing its odds.
+    def __init__(self, evaluator: Evaluator, pocket, bis_formatting=False):
+        self.evaluator = evaluator
+        self.bis_formatting = bis_formatting
+        self.pocket = self._parse(pocket)
+        self.board = []
+        self.dead = np.zeros(52, dtype=np.bool_)
+        self.board_ref = 53
+        self.board_pocket_ref = 53
+        self._add(self.pocket)
+
+    def _parse(self, cards):
+        if isinstance(cards, str):
+            return str_to_cards_bis(cards) if self.bis_formatting else str_to_cards(cards)
+        return list(cards)
+
+    def _add(self, cards: List[Card]):
+        cards = cards_to_array(cards)
+        if self.dead[cards].any() or len(np.unique(cards)) != len(cards):
+            raise RuntimeError("card dealt twice")
+        self.dead[cards] = True
+        self.board_pocket_ref = _walk(self.evaluator.rank_table, self.board_pocket_ref, cards)
+
+    def deal(self, cards):
+        # Adds the cards of the next street(s) to the board
+        cards = self._parse(cards)
+        if len(self.board) + len(cards) not in (0, 3, 4, 5):
+            raise RuntimeError("invalid board size")
+        self._add(cards)
+        self.board_ref = _walk(self.evaluator.rank_table, self.board_ref, cards_to_array(cards))
+        self.board += cards
+
+    def rank(self):
+        if len(self.board) == 0:
+            return None
+        if len(self.board) < 5:
+            return int(self.evaluator.rank_table[self.board_pocket_ref])
+        return int(self.board_pocket_ref)
+
+    def checker(self):
+        if len(self.board) == 0:
+            return None
+        return self.evaluator.get_checker(self.pocket, self.board)
+
+    def odds(self, n_opponents: int=1):
+        # Same as Evaluator.check_odds, the exact heads-up odds start from the kept nodes
+        evaluator = self.evaluator
+        if n_opponents != 1 or len(self.board) == 0 or (evaluator.precomputed and len(self.board) < 5):
+            return evaluator.check_odds(self.pocket, self.board, n_opponents)
+        return evaluator._cached(('odds', n_opponents, evaluator.precomputed), self.pocket + self.board, self._exact_odds)
+
+    def _exact_odds(self):
+        wins, draws, total = _exact_odds(self.evaluator.rank_table, self.board_ref, self.board_pocket_ref,
+                                         np.nonzero(~self.dead)[0], 5 - len(self.board))
+        return wins/total, draws/total
+
+    def evaluate(self, n_opponents: int=1):
+        # rank, checker, then the odds, like Evaluator.full_evaluation
+        return (self.rank(), self.checker()) + self.odds(n_opponents)
+
+
+def run_preflop(session):
+    _, _, prob_win, prob_draw = session.evaluate()
     print(f"Prob win : {prob_win*100:.2f}%, Prob draw : {prob_draw*100:.2f}%\n")
 
 
-def run_after_flop(evaluator, cards):
-    rank, checker, prob_win, prob_draw = evaluator.full_evaluation(pocket, cards)
-    rank_str = evaluator.rank_to_str(rank)
+def run_after_flop(session):
+    rank, checker, prob_win, prob_draw = session.evaluate()
+    rank_str = session.evaluator.rank_to_str(rank)
     print(f"Rank : {rank_str} ({rank}),  Checker : {checker:.2f},  Prob win : {prob_win*100:.2f}%, Prob draw : {prob_draw*100:.2f}%\n")
 
 
@@ -298,24 +1147,28 @@ def run(pocket='', flop='', turn='', river=''):
     print("")
     if pocket == '':
         pocket = input()
+    session = HandSession(evaluator, pocket)
     
     print("Preflop : ")
-    run_preflop(evaluator, pocket)
+    run_preflop(session)
 
     if flop == '':
         return
     print("Flop")
-    run_after_flop(evaluator, flop)
+    session.deal(flop)
+    run_after_flop(session)
 
     if turn == '':
         return
     print("Turn")
-    run_after_flop(evaluator, flop + turn)
+    session.deal(turn)
+    run_after_flop(session)
 
     if river == '':
         return
     print("River")
-    run_after_flop(evaluator, flop + turn + river)
+    session.deal(river)
+    run_after_flop(session)
 
 
 if __name__ == '__main__':
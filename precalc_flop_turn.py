@@ -0,0 +1,54 @@
+import numpy as np
+import os
+import time
+from hand_index import HandIndexer
+from poker_eval import Evaluator
+
+
+# Exact odds of every suit-isomorphic (pocket, flop) and (pocket, flop + turn) class, stored as a
+# float32 (N, 2) array of prob_win, prob_draw indexed by HandIndexer([2, 3]) and HandIndexer([2, 4]).
+# The table is written in place in a .partial file and the number of classes already computed is kept
+# in a .progress file, so an interrupted build resumes where it stopped.
+
+
+def build_table(evaluator: Evaluator, cards_per_round, output, chunksize):
+    indexer = HandIndexer(cards_per_round)
+    partial_filename = output + '.partial'
+    progress_filename = output + '.progress'
+    if os.path.exists(partial_filename) and os.path.exists(progress_filename):
+        table = np.lib.format.open_memmap(partial_filename, mode='r+')
+        n_processed = int(open(progress_filename).read())
+    else:
+        table = np.lib.format.open_memmap(partial_filename, mode='w+', dtype=np.float32, shape=(indexer.size, 2))
+        n_processed = 0
+
+    start = time.time()
+    n_start = n_processed
+    while n_processed < indexer.size:
+        end = min(n_processed + chunksize, indexer.size)
+        hands = indexer.unindex_batch(np.arange(n_processed, end))
+        table[n_processed:end] = evaluator.check_odds_exact_batch(hands[:, :2], hands[:, 2:])
+        table.flush()
+        with open(progress_filename + '.tmp', 'w') as f:
+            f.write(str(end))
+        os.replace(progress_filename + '.tmp', progress_filename)
+        n_processed = end
+        speed = (n_processed - n_start) / (time.time() - start)
+        print(f'\r{n_processed:,} / {indexer.size:,} ({speed:,.0f} hands/s)', end='')
+    print("")
+    del table
+    os.replace(partial_filename, output)
+    os.remove(progress_filename)
+
+
+def run(chunksize=10_000):
+    evaluator = Evaluator()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    print("Turn table")
+    build_table(evaluator, [2, 4], os.path.join(directory, 'turn_table.npy'), chunksize)
+    print("Flop table")
+    build_table(evaluator, [2, 3], os.path.join(directory, 'flop_table.npy'), chunksize)
+
+
+if __name__ == '__main__':
+    run()
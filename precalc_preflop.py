@@ -1,35 +1,42 @@
-
-from poker_eval import Evaluator, Card, suits, values
+from itertools import combinations
 import numpy as np
+import os
+import time
+from hand_index import HandIndexer
+from poker_eval import Evaluator, POCKETS
+
+
+# Exact heads-up odds of the 169 preflop classes, stored as a (169, 2) array of prob_win, prob_draw
+# indexed by HandIndexer([2]).
+# Every pocket is matched against every opponent pocket on every board. The boards are enumerated up to
+# suit isomorphism : a suit permutation maps the pockets of a class to the same class, so each canonical
+# board is counted once, weighted by the number of boards isomorphic to it.
+# The table is heads-up only : the counts are wins and draws against a single opponent, from which the odds
+# against several opponents cannot be rebuilt. check_odds(..., n_opponents > 1) computes those preflop odds
+# with check_odds_multiway (Monte Carlo) on every call.
+
+
+def build_table(evaluator: Evaluator):
+    board_indexer = HandIndexer([5])
+    boards = np.array(list(combinations(range(52), 5)), dtype=np.int64)
+    weights = np.bincount(board_indexer.index_batch(boards), minlength=board_indexer.size)
+    canonical_boards = board_indexer.unindex_batch(np.arange(board_indexer.size))
+    wins, draws, totals = evaluator.pocket_counts(canonical_boards, weights)
+
+    classes = evaluator.preflop_indexer.index_batch(POCKETS)
+    class_wins = np.bincount(classes, weights=wins, minlength=evaluator.preflop_indexer.size)
+    class_draws = np.bincount(classes, weights=draws, minlength=evaluator.preflop_indexer.size)
+    class_totals = np.bincount(classes, weights=totals, minlength=evaluator.preflop_indexer.size)
+    return np.stack((class_wins / class_totals, class_draws / class_totals), axis=1)
+
+
+def run():
+    evaluator = Evaluator()
+    start = time.time()
+    table = build_table(evaluator)
+    print(f"Preflop table built in {time.time() - start:.1f} seconds")
+    np.save(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preflop_table.npy'), table)
+
 
-preflop_table = np.zeros((52, 52, 2), dtype=float)
-evaluator = Evaluator(preflop_table=False)
-
-n_samples = 100_000
-
-for value_idx_1 in range(13):
-    for value_idx_2 in range(value_idx_1, 13):
-        print(value_idx_1, value_idx_2)
-        value1 = values[value_idx_1]
-        value2 = values[value_idx_2]
-        diff_color_cards = [Card.from_str(value1 + suits[0]), Card.from_str(value2 + suits[1])]
-        diff_color_odds = evaluator.check_odds(diff_color_cards, [], n_samples)
-
-        if value1 != value2:
-            same_color_cards = [Card.from_str(value1 + suits[0]), Card.from_str(value2 + suits[0])]
-            same_color_odds = evaluator.check_odds(same_color_cards, [], n_samples)
-
-        for suit1 in suits:
-            for suit2 in suits:
-                if suit1 == suit2 and value1 == value2:
-                    continue
-                card1 = Card.from_str(value1 + suit1)
-                card2 = Card.from_str(value2 + suit2)
-                if suit1 == suit2:
-                    odds = same_color_odds
-                else:
-                    odds = diff_color_odds
-                preflop_table[card1.idx, card2.idx] = np.array(odds)
-                preflop_table[card2.idx, card1.idx] = np.array(odds)
-
-np.save('preflop_table.npy', preflop_table)
\ No newline at end of file
+if __name__ == '__main__':
+    run()
@@ -1,55 +1,213 @@
-
+import os
+import shutil
 import time
 import numpy as np
 import pandas as pd
-from poker_eval import Evaluator
+from hand_index import HandIndexer, STREETS_CARDS_PER_ROUND, NO_CARD
+from poker_eval import Evaluator, strs_to_hands, histograms_to_strs, POTENTIAL_METRICS
+
+STREETS = ('preflop', 'flop', 'turn', 'river')
+CARD_COLUMNS = ('Pocket', 'Table', 'Turn', 'River')
+
+
+def process_street(evaluator: Evaluator, indexer: HandIndexer, hands: np.ndarray, results: dict, stage: str, metrics=False):
+    # Evaluates once each suit-isomorphic situation of the street and scatters the results back to the rows.
+    # With metrics, the hand potential metrics are added. The odds come from the same enumeration,
+    # except on the flop and turn with precomputed tables, where they are still read from the tables
+    n_cards = indexer.cards_per_round.sum()
+    rows = np.nonzero((hands[:, :n_cards] != NO_CARD).all(axis=1))[0]
+    start = time.time()
+    ids = indexer.index_batch(hands[rows, :n_cards])
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    situations = indexer.unindex_batch(unique_ids)
 
-def process_stage(evaluator: Evaluator, pocket_str: str, board_str: str, row, stage):
-    rank, checker, prob_win, prob_draw = evaluator.full_evaluation(pocket_str, board_str)
-    row['proba_win_' + stage] = prob_win
-    row['proba_draw_' + stage] = prob_draw
+    odds = None
+    if metrics and stage != 'preflop':
+        street_metrics = evaluator.hand_metrics_batch(situations[:, :2], situations[:, 2:])
+        if not (evaluator.precomputed and stage in ('flop', 'turn')):
+            odds = np.stack((street_metrics['proba_win'], street_metrics['proba_draw']), axis=1)
+        for metric in POTENTIAL_METRICS:
+            results[metric + '_' + stage][rows] = street_metrics[metric][inverse]
+        results['equity_histogram_' + stage][rows] = histograms_to_strs(street_metrics['equity_histogram'])[inverse]
+    if odds is None:
+        odds = evaluator.check_odds_batch(situations[:, :2], situations[:, 2:])
+    results['proba_win_' + stage][rows] = odds[inverse, 0]
+    results['proba_draw_' + stage][rows] = odds[inverse, 1]
     if stage != 'preflop':
-        rank_str = evaluator.rank_to_str(rank)
-        row['best_hand_' + stage] = rank_str
-        row['checker_' + stage] = checker
+        results['best_hand_' + stage][rows] = evaluator.ranks_to_str(evaluator.eval_batch(situations))[inverse]
+        results['checker_' + stage][rows] = evaluator.get_checker_batch(situations)[inverse]
 
-def process_row(evaluator: Evaluator, row):
-    process_stage(evaluator, row['Pocket'], "", row, 'preflop')
-    if row['Table'] == "":
-        return
-    process_stage(evaluator, row['Pocket'], row['Table'], row, 'flop')
-    if row['Turn'] == "":
-        return
-    process_stage(evaluator, row['Pocket'], row['Table'] + row['Turn'], row, 'turn')
-    if row['River'] == "":
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"  {stage:<7} : {len(rows):,} rows, {len(unique_ids):,} unique situations "
+          f"| {len(rows) / elapsed:,.0f} rows/s, {len(unique_ids) / elapsed:,.0f} unique situations/s")
+
+
+def empty_results(n_rows: int, metrics=False):
+    results = {
+        'proba_win_preflop': np.full(n_rows, np.nan),
+        'proba_draw_preflop': np.full(n_rows, np.nan),
+    }
+    for stage in STREETS[1:]:
+        results['best_hand_' + stage] = np.full(n_rows, np.nan, dtype=object)
+        for col in ('checker', 'proba_win', 'proba_draw') + (POTENTIAL_METRICS if metrics else ()):
+            results[col + '_' + stage] = np.full(n_rows, np.nan)
+        if metrics:
+            results['equity_histogram_' + stage] = np.full(n_rows, np.nan, dtype=object)
+    return results
+
+
+def process_df(evaluator: Evaluator, df: pd.DataFrame, metrics=False):
+    # Adds the result columns to df, missing cards are ''
+    hands = strs_to_hands(df['Pocket'], df['Table'], df['Turn'], df['River'])
+    results = empty_results(len(df), metrics)
+    for stage, cards_per_round in zip(STREETS, STREETS_CARDS_PER_ROUND):
+        process_street(evaluator, HandIndexer(cards_per_round), hands, results, stage, metrics)
+    for col, values in results.items():
+        df[col] = values
+    return df
+
+
+def read_csv(csv_path, sep=';', chunksize=None, skip=0):
+    # skip : number of rows to skip after the header
+    skiprows = (lambda i: 0 < i <= skip) if skip > 0 else None
+    df = pd.read_csv(csv_path, sep=sep, chunksize=chunksize, skiprows=skiprows)
+    if chunksize is None:
+        return df.fillna({col: '' for col in CARD_COLUMNS})
+    return (chunk.fillna({col: '' for col in CARD_COLUMNS}) for chunk in df)
+
+
+def to_arrow(df: pd.DataFrame):
+    # Typed columns for the Parquet output : strings for the cards and the hand names, float64 for the checkers,
+    # probabilities and metrics (null when the street is not dealt), the other columns keep their pandas type
+    import pyarrow as pa
+    fields = []
+    for col in df.columns:
+        if col in CARD_COLUMNS or col.startswith(('best_hand_', 'equity_histogram_')):
+            col_type = pa.string()
+        elif col.startswith(('proba_', 'checker_')) or col.rsplit('_', 1)[0] in POTENTIAL_METRICS:
+            col_type = pa.float64()
+        else:
+            col_type = pa.Schema.from_pandas(df[[col]], preserve_index=False).field(col).type
+            if pa.types.is_null(col_type):
+                col_type = pa.string()
+        fields.append(pa.field(col, col_type))
+    return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+
+def is_parquet(output_path):
+    return output_path.endswith('.parquet')
+
+
+class CsvOutput:
+    # Chunks appended to a single file, the position is its size in bytes
+    def __init__(self, path, position, sep):
+        self.sep = sep
+        self.f = open(path, 'r+b' if position > 0 else 'wb')
+        self.f.truncate(position)
+        self.f.seek(position)
+
+    def write(self, df: pd.DataFrame, header: bool):
+        self.f.write(df.to_csv(sep=self.sep, index=False, header=header).encode())
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def finish(self, path, output_path):
+        self.f.close()
+        os.replace(path, output_path)
+
+
+class ParquetOutput:
+    # One Parquet file per chunk in a directory, merged into a single file (one row group per chunk) at the end.
+    # The position is the number of chunks written.
+    def __init__(self, path, position):
+        self.path = path
+        self.position = position
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if not name.endswith('.parquet') or int(name.split('.')[0]) >= position:
+                os.remove(os.path.join(path, name))
+
+    def write(self, df: pd.DataFrame, header: bool):
+        import pyarrow.parquet as pq
+        part = os.path.join(self.path, f'{self.position:06d}.parquet')
+        pq.write_table(to_arrow(df), part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self.position += 1
+        return self.position
+
+    def finish(self, path, output_path):
+        import pyarrow.parquet as pq
+        if self.position == 0:
+            raise RuntimeError("no row to write")
+        parts = [os.path.join(path, f'{i:06d}.parquet') for i in range(self.position)]
+        schema = pq.read_schema(parts[0])
+        with pq.ParquetWriter(output_path + '.tmp', schema) as writer:
+            for part in parts:
+                writer.write_table(pq.read_table(part).cast(schema))
+        os.replace(output_path + '.tmp', output_path)
+        shutil.rmtree(path)
+
+
+def process_csv_chunks(evaluator: Evaluator, csv_path, output_path, sep=';', metrics=False, chunksize=100_000):
+    # Streams the input by chunks of chunksize rows : the memory does not depend on the size of the input.
+    # The output is written chunk by chunk to output_path + '.partial', and the number of rows done and the
+    # position of the output after the last complete chunk are kept in output_path + '.progress', so an
+    # interrupted run started again with the same arguments resumes after the last complete chunk.
+    partial_filename = output_path + '.partial'
+    progress_filename = output_path + '.progress'
+    n_processed, position = 0, 0
+    if os.path.exists(partial_filename) and os.path.exists(progress_filename):
+        n_processed, position = (int(x) for x in open(progress_filename).read().split())
+        print(f"  Resuming after {n_processed:,} rows")
+    if is_parquet(output_path):
+        output = ParquetOutput(partial_filename, position)
+    else:
+        output = CsvOutput(partial_filename, position, sep)
+
+    start = time.time()
+    n_start = n_processed
+    for df in read_csv(csv_path, sep, chunksize, skip=n_processed):
+        process_df(evaluator, df, metrics)
+        position = output.write(df, header=(n_processed == 0))
+        n_processed += len(df)
+        with open(progress_filename + '.tmp', 'w') as f:
+            f.write(f'{n_processed} {position}')
+        os.replace(progress_filename + '.tmp', progress_filename)
+        speed = (n_processed - n_start) / max(time.time() - start, 1e-9)
+        print(f"  {n_processed:,} rows done ({speed:,.0f} rows/s)")
+    output.finish(partial_filename, output_path)
+    os.remove(progress_filename)
+
+
+def process_csv(csv_path, output_path, sep=';', metrics=False, precomputed=True, chunksize=None):
+    # metrics : adds the hand strength, potential and equity histogram columns of each street after the preflop.
+    #   They need an enumeration of the runouts against every opponent pocket, which also gives the odds. With
+    #   precomputed=True, the flop and turn odds are still read from the tables, and the enumeration of the metrics
+    #   takes several times longer than these lookups. Without tables, the runtime barely changes
+    # precomputed : reads the flop and turn odds from the tables built by precalc_flop_turn.py instead of computing them
+    # chunksize : streams the input by chunks of chunksize rows, with resume (see process_csv_chunks)
+    # An output_path ending with .parquet is written as Parquet with typed columns (needs pyarrow)
+    evaluator = Evaluator(precomputed=precomputed)
+    if chunksize is not None:
+        process_csv_chunks(evaluator, csv_path, output_path, sep, metrics, chunksize)
         return
-    process_stage(evaluator, row['Pocket'], row['Table'] + row['Turn'] + row['River'], row, 'river')
-
-def process_csv(csv_path, output_path, sep=';'):
-    df = pd.read_csv(csv_path, sep=sep)
-    df = df.fillna('')
-    df['proba_win_preflop'] = np.nan
-    df['proba_draw_preflop'] = np.nan
-    for stage in ('flop', 'turn', 'river'):
-        for col in ('best_hand', 'checker', 'proba_win', 'proba_draw'):
-            df[col + '_' + stage] = np.nan
-
-    evaluator = Evaluator(precomputed=True)
+    df = read_csv(csv_path, sep)
     start = time.time()
-    n_processed = 0
-    for idx, row in df.iterrows():
-        process_row(evaluator, row)
-        df.iloc[idx] = row
-        n_processed += 1
-        if n_processed % 100 == 0:
-            end = time.time()
-            print(f"  Time spent : {end - start:.1f} seconds | Rows processed : {n_processed}", end='\r')
-    print('')
-    df.to_csv(output_path, sep=sep, index=False)
+    process_df(evaluator, df, metrics)
+    end = time.time()
+    print(f"  Time spent : {end - start:.1f} seconds | Rows processed : {len(df)} | {len(df) / (end - start):,.0f} rows/s")
+
+    if is_parquet(output_path):
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow(df), output_path)
+    else:
+        df.to_csv(output_path, sep=sep, index=False)
 
 
 if __name__=='__main__':
     process_csv(
         csv_path="input.csv",
         output_path="output.csv",
-    )
\ No newline at end of file
+    )
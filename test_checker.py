@@ -0,0 +1,56 @@
+from random import Random
+import os
+import numpy as np
+import pytest
+from poker_eval import Evaluator, Card, HAND_SIZES, NO_CARD
+
+# Compares get_checker and get_checker_batch with the original definition of the checker, on random hands
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rank_table.bin')):
+    pytest.skip("rank_table.bin is not built (python build_rank_table.py)", allow_module_level=True)
+
+N_HANDS = 500
+
+
+def reference_contribution(evaluator: Evaluator, cards, idx):
+    # Largest rank loss when the card at idx is replaced by any card outside the hand
+    true_rank = evaluator.eval(cards)
+    fake_cards = list(cards)
+    max_contrib = 0
+    for card in evaluator.deck:
+        if card in cards:
+            continue
+        fake_cards[idx] = card
+        contribution = true_rank - evaluator.eval(fake_cards)
+        if contribution > max_contrib:
+            max_contrib = contribution
+    return max_contrib
+
+
+def reference_checker(evaluator: Evaluator, pocket, board):
+    # Share of the board cards among the cards making the hand, the cards contributing the most to the rank
+    cards = pocket + board
+    hand_size = HAND_SIZES[evaluator.eval(cards) >> 12]
+    contributions = [reference_contribution(evaluator, cards, idx) for idx in range(len(cards))]
+    sorted_cards = sorted(range(len(cards)), reverse=True, key=lambda idx: (contributions[idx], idx))
+    board_contribution = sum(1 for card in sorted_cards[:hand_size] if card >= 2)
+    return board_contribution / hand_size
+
+
+@pytest.fixture(scope='module')
+def evaluator():
+    return Evaluator()
+
+
+@pytest.mark.parametrize('n_cards', [5, 6, 7])
+def test_checker(evaluator, n_cards):
+    rng = Random(n_cards)
+    hands = [[Card(card) for card in rng.sample(range(52), n_cards)] for _ in range(N_HANDS)]
+    expected = np.array([reference_checker(evaluator, hand[:2], hand[2:]) for hand in hands])
+
+    checkers = np.array([evaluator.get_checker(hand[:2], hand[2:]) for hand in hands])
+    np.testing.assert_array_equal(checkers, expected)
+
+    cards = np.full((N_HANDS, 7), NO_CARD, dtype=np.int64)
+    cards[:, :n_cards] = [[card.idx for card in hand] for hand in hands]
+    np.testing.assert_array_equal(evaluator.get_checker_batch(cards), expected)
@@ -0,0 +1,24 @@
+import os
+import pytest
+from poker_eval import Evaluator, str_to_cards
+
+# Number of opponents at the limit of the cards left for their pockets (45 live cards preflop and on the river)
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rank_table.bin')):
+    pytest.skip("rank_table.bin is not built (python build_rank_table.py)", allow_module_level=True)
+
+
+@pytest.fixture(scope='module')
+def evaluator():
+    return Evaluator()
+
+
+@pytest.mark.parametrize('board', ['', 'kh2c3d7s9h'])
+def test_opponents_limit(evaluator, board):
+    pocket = str_to_cards('asad')
+    board = str_to_cards(board)
+    prob_win, prob_ties, prob_loss = evaluator.check_odds_multiway(pocket, board, 22, n_samples=1000, seed=0)
+    assert len(prob_ties) == 22
+    assert abs(prob_win + prob_ties.sum() + prob_loss - 1) < 1e-9
+    with pytest.raises(RuntimeError):
+        evaluator.check_odds_multiway(pocket, board, 23, n_samples=1000, seed=0)